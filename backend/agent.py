@@ -0,0 +1,175 @@
+"""轻量级推送 Agent（仅依赖 Python 标准库）
+
+在被监控主机上运行：本地读取 /proc 计数器采样，按批 gzip 压缩后推送到
+监控服务器的 /api/ingest 接口。服务器不可达时样本暂存在内存中（有上限），
+恢复后一并补推。
+
+用法:
+    python3 agent.py --server http://monitor:5000 --host-id 3 --token <token>
+
+也可通过环境变量 MONITOR_SERVER / MONITOR_HOST_ID / MONITOR_TOKEN 配置。
+"""
+import argparse
+import collections
+import gzip
+import json
+import os
+import re
+import time
+import urllib.error
+import urllib.request
+
+DISK_SECTOR_BYTES = 512
+# 只统计整块物理磁盘，跳过分区、loop、ram、device-mapper 等设备
+DISK_DEVICE_RE = re.compile(r'^(sd[a-z]+|vd[a-z]+|xvd[a-z]+|hd[a-z]+|nvme\d+n\d+|mmcblk\d+)$')
+
+def read_cpu_times():
+    """返回 (总时间片, 空闲时间片)"""
+    with open('/proc/stat') as f:
+        fields = f.readline().split()
+    values = [int(x) for x in fields[1:9]]
+    return sum(values), values[3] + values[4]
+
+def read_memory():
+    """返回 (总内存KB, 已用内存KB)"""
+    meminfo = {}
+    with open('/proc/meminfo') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2:
+                meminfo[parts[0].rstrip(':')] = int(parts[1])
+    total = meminfo.get('MemTotal', 0)
+    available = meminfo.get('MemAvailable',
+                            meminfo.get('MemFree', 0) + meminfo.get('Buffers', 0) + meminfo.get('Cached', 0))
+    return total, total - available
+
+def read_disk_io():
+    """返回 (读扇区数, 写扇区数)"""
+    read_sectors = write_sectors = 0
+    with open('/proc/diskstats') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 10 and DISK_DEVICE_RE.match(fields[2]):
+                read_sectors += int(fields[5])
+                write_sectors += int(fields[9])
+    return read_sectors, write_sectors
+
+def read_net_io():
+    """返回 (接收字节数, 发送字节数)，不含 lo"""
+    rx = tx = 0
+    with open('/proc/net/dev') as f:
+        for line in f:
+            if ':' not in line:
+                continue
+            name, data = line.split(':', 1)
+            if name.strip() == 'lo':
+                continue
+            data = data.split()
+            rx += int(data[0])
+            tx += int(data[8])
+    return rx, tx
+
+def read_counters():
+    return {
+        'time': time.monotonic(),
+        'cpu': read_cpu_times(),
+        'disk_io': read_disk_io(),
+        'net_io': read_net_io()
+    }
+
+def rate(prev, curr, elapsed):
+    if elapsed <= 0 or curr < prev:
+        return None
+    return round((curr - prev) / elapsed, 2)
+
+def take_sample(prev):
+    """采样一次，返回 (样本, 本次计数器)"""
+    counters = read_counters()
+    elapsed = counters['time'] - prev['time']
+
+    total_delta = counters['cpu'][0] - prev['cpu'][0]
+    idle_delta = counters['cpu'][1] - prev['cpu'][1]
+    cpu_usage = (total_delta - idle_delta) / total_delta * 100 if total_delta > 0 else 0
+
+    memory_total_kb, memory_used_kb = read_memory()
+    disk = os.statvfs('/')
+    disk_total = disk.f_blocks * disk.f_frsize
+    disk_used = (disk.f_blocks - disk.f_bfree) * disk.f_frsize
+
+    read_rate = rate(prev['disk_io'][0], counters['disk_io'][0], elapsed)
+    write_rate = rate(prev['disk_io'][1], counters['disk_io'][1], elapsed)
+
+    sample = {
+        'cpu_usage': round(max(0.0, min(100.0, cpu_usage)), 2),
+        'memory_usage': round(memory_used_kb / memory_total_kb * 100, 2) if memory_total_kb > 0 else 0,
+        'memory_total': round(memory_total_kb / 1024),
+        'memory_used': round(memory_used_kb / 1024),
+        'disk_usage': round(disk_used / disk_total * 100, 2) if disk_total > 0 else 0,
+        'load_avg': [round(x, 2) for x in os.getloadavg()],
+        'disk_read_bps': read_rate * DISK_SECTOR_BYTES if read_rate is not None else None,
+        'disk_write_bps': write_rate * DISK_SECTOR_BYTES if write_rate is not None else None,
+        'net_rx_bps': rate(prev['net_io'][0], counters['net_io'][0], elapsed),
+        'net_tx_bps': rate(prev['net_io'][1], counters['net_io'][1], elapsed),
+        'timestamp': time.time()
+    }
+    return sample, counters
+
+def push_samples(server, host_id, token, samples, timeout=10):
+    """把一批样本压缩后推送到服务器，成功返回 True"""
+    payload = {'hosts': [{'host_id': host_id, 'token': token, 'samples': samples}]}
+    body = gzip.compress(json.dumps(payload).encode('utf-8'))
+    req = urllib.request.Request(
+        server.rstrip('/') + '/api/ingest',
+        data=body,
+        headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'},
+        method='POST'
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            result = json.loads(resp.read().decode('utf-8'))
+        if host_id in result.get('rejected', []):
+            print(f"推送被拒绝，请检查 host_id/token: {host_id}")
+            return False
+        return True
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        print(f"推送失败: {str(e)}")
+        return False
+
+def run(server, host_id, token, sample_interval, push_interval, max_buffer):
+    buffer = collections.deque(maxlen=max_buffer)  # 服务器不可达时丢弃最旧的样本
+    counters = read_counters()
+    next_push = time.monotonic() + push_interval
+    print(f"Agent 已启动: 主机 {host_id} -> {server}，每 {sample_interval} 秒采样，每 {push_interval} 秒推送")
+
+    while True:
+        time.sleep(sample_interval)
+        try:
+            sample, counters = take_sample(counters)
+            buffer.append(sample)
+        except (OSError, ValueError, IndexError) as e:
+            print(f"采样失败: {str(e)}")
+
+        if time.monotonic() >= next_push and buffer:
+            batch = list(buffer)
+            if push_samples(server, host_id, token, batch):
+                for _ in range(len(batch)):
+                    buffer.popleft()
+            next_push = time.monotonic() + push_interval
+
+def main():
+    parser = argparse.ArgumentParser(description='服务器监控推送 Agent')
+    parser.add_argument('--server', default=os.environ.get('MONITOR_SERVER', 'http://127.0.0.1:5000'))
+    parser.add_argument('--host-id', type=int, default=int(os.environ.get('MONITOR_HOST_ID', 0)))
+    parser.add_argument('--token', default=os.environ.get('MONITOR_TOKEN', ''))
+    parser.add_argument('--sample-interval', type=float, default=float(os.environ.get('SAMPLE_INTERVAL', 5)))
+    parser.add_argument('--push-interval', type=float, default=float(os.environ.get('PUSH_INTERVAL', 30)))
+    parser.add_argument('--max-buffer', type=int, default=int(os.environ.get('MAX_BUFFER', 2000)))
+    args = parser.parse_args()
+
+    if not args.host_id or not args.token:
+        parser.error('必须指定 --host-id 和 --token')
+
+    run(args.server, args.host_id, args.token, args.sample_interval, args.push_interval, args.max_buffer)
+
+if __name__ == '__main__':
+    main()
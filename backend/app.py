@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 import sqlite3
 import paramiko
 import re
@@ -7,13 +7,42 @@ import threading
 import json
 import os
 import random
+import base64
+from datetime import datetime, timezone
+import atexit
+import queue
+import signal
+import sys
+import bisect
+import hashlib
+import heapq
+import collections
+import itertools
+import multiprocessing
+import hmac
+import secrets
+import socket
+import ipaddress
+import zlib
+import math
+import urllib.parse
+import csv
+import io
+import struct
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from proc_counters import (COLLECT_SCRIPT, collector_state, collector_state_lock,
+                           parse_proc_counters, compute_host_rates)
+
+try:
+    import numpy as np
+except ImportError:  # 未安装 numpy 时聚合查询退回逐行计算
+    np = None
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'
 
-# 存储实时监控数据
-realtime_metrics = {}
-
 # === 前端服务 ===
 @app.route('/')
 def index():
@@ -72,14 +101,263 @@ def serve_static(filename):
         return "File not found", 404
 
 # === 数据库操作 ===
-def get_db():
-    conn = sqlite3.connect('/app/data/monitor.db')
+DATABASE_PATH = os.environ.get('DATABASE_PATH', '/app/data/monitor.db')
+DATABASE_READONLY = os.environ.get('DATABASE_READONLY', '0') == '1'        # 只读打开数据库，不建表、不迁移（离线导出）
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))                        # 连接池保留的空闲连接数
+DB_CACHE_SIZE_KB = int(os.environ.get('DB_CACHE_SIZE_KB', 20000))            # 每个连接的页缓存（KB）
+DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', 256 * 1024 * 1024))        # 内存映射读取上限（字节）
+DB_STATEMENT_CACHE = 256                                                     # 每个连接缓存的预编译语句数
+ROLLUP_RESOLUTIONS = (60, 300, 3600)                                         # 降采样桶宽度（秒）：1分钟 / 5分钟 / 1小时
+ROLLUP_FIELDS = ('cpu_usage', 'memory_usage', 'disk_usage')
+ROLLUP_AGGS = ('min', 'max', 'sum', 'count')
+ROLLUP_COLUMNS = [f'{field}_{agg}' for field in ROLLUP_FIELDS for agg in ROLLUP_AGGS]
+
+# 分区保留天数，0 表示永久保留
+RETENTION_RAW_DAYS = float(os.environ.get('RETENTION_RAW_DAYS', 7))          # 原始采样
+RETENTION_DAYS_BY_RESOLUTION = {
+    60: float(os.environ.get('RETENTION_1M_DAYS', 30)),                      # 1分钟汇总
+    300: float(os.environ.get('RETENTION_5M_DAYS', 90)),                     # 5分钟汇总
+    3600: float(os.environ.get('RETENTION_1H_DAYS', 365)),                   # 1小时汇总
+}
+RETENTION_CHECK_INTERVAL = int(os.environ.get('RETENTION_CHECK_INTERVAL', 3600))  # 清理过期分区的间隔（秒）
+# 每个分区表覆盖的时间跨度（秒）：粗粒度汇总数据量小，分区跨度更大，避免表数量过多
+RAW_PARTITION_SPAN = 86400
+CHUNK_COMPACT_DELAY = int(os.environ.get('CHUNK_COMPACT_DELAY', 3600))      # 分区结束多久后压缩为数据块（秒）
+CHUNK_MAX_POINTS = 4096                                                      # 单个压缩块最多包含的样本数
+MIGRATION_BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', 5000))    # 旧格式数据迁移时每个事务转换的行数
+SECONDS_TIMESTAMP_LIMIT = 10 ** 11                                           # 小于该值的时间戳按秒处理
+CHUNK_ORDINAL_BASE = -(1 << 40)                                              # 压缩块样本的游标序号为负数，与原始行 id 区分
+MIGRATION_PAUSE = float(os.environ.get('MIGRATION_PAUSE', 0.05))            # 迁移批次之间的间隔，让出写锁（秒）
+ROLLUP_PARTITION_SPANS = {60: 86400, 300: 7 * 86400, 3600: 30 * 86400}
+HOST_INDEXES = {                                                             # 主机列表分页、过滤使用的索引
+    'idx_hosts_name': 'name',
+    'idx_hosts_ip': 'ip',
+    'idx_hosts_created': 'created_at',
+    'idx_hosts_type_name': 'host_type, name',
+    'idx_hosts_type_created': 'host_type, created_at',
+}
+SIMULATED_IP_FIRST = ipaddress.IPv4Address('127.0.0.100')                    # 模拟主机地址从这里开始顺序分配
+SIMULATED_IP_LAST = ipaddress.IPv4Address('127.255.255.254')                 # 整个 127.0.0.0/8 回环网段可用
+SIMULATED_IP_CHECK_BATCH = 500                                               # 分配模拟地址时每条查询检查的候选地址数
+BULK_HOSTS_MAX = int(os.environ.get('BULK_HOSTS_MAX', 50000))               # 单次批量添加主机的上限
+
+def open_db():
+    """新建数据库连接并设置性能相关的 PRAGMA"""
+    if DATABASE_READONLY:
+        conn = sqlite3.connect(f'file:{urllib.parse.quote(os.path.abspath(DATABASE_PATH))}?mode=ro', uri=True,
+                               timeout=10, check_same_thread=False, cached_statements=DB_STATEMENT_CACHE)
+    else:
+        conn = sqlite3.connect(DATABASE_PATH, timeout=10, check_same_thread=False,
+                               cached_statements=DB_STATEMENT_CACHE)
+        conn.execute('PRAGMA journal_mode=WAL')    # 读写互不阻塞，看板读取不再等待采集写入
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA synchronous=NORMAL')      # WAL 模式下只在检查点 fsync
+    conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store=MEMORY')
     return conn
 
+class ConnectionPool:
+    """SQLite 连接池：连接复用后预编译语句缓存和页缓存才能生效"""
+
+    def __init__(self, size=DB_POOL_SIZE):
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._inherited = []
+
+    def _acquire(self):
+        with self._lock:
+            if os.getpid() != self._pid:
+                # fork 出的采集进程不能使用父进程的连接，保留引用避免在子进程中关闭
+                self._inherited.extend(self._idle)
+                self._idle = []
+                self._pid = os.getpid()
+            if self._idle:
+                return self._idle.pop()
+        return open_db()
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.size and os.getpid() == self._pid:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        """借出一个连接，正常结束时提交，异常时回滚"""
+        conn = self._acquire()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            # 回滚也撤销了本事务内建的分区表
+            TimePartitions.forget_created()
+            raise
+        finally:
+            self._release(conn)
+
+db_pool = ConnectionPool()
+
+def get_db():
+    """用法: with get_db() as conn: ..."""
+    return db_pool.connection()
+
+def parse_time_param(value):
+    """把 epoch 秒或 ISO 8601 时间（无时区按 UTC）解析为 epoch 秒"""
+    try:
+        return float(value)
+    except ValueError:
+        dt = datetime.fromisoformat(value)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+
+def to_db_timestamp(epoch):
+    """epoch 秒转换为库中 CURRENT_TIMESTAMP 的 UTC 文本格式"""
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+class TimePartitions:
+    """按时间切分的一组同结构表，表名为 {prefix}_pYYYYMMDD（分区起始日期，UTC）
+
+    写入时按时间路由到对应分区并按需建表；查询只访问与时间范围重叠的分区；
+    过期数据整表 DROP，不再逐行 DELETE。
+    """
+    _instances = []
+
+    def __init__(self, prefix, span, retention_days, schema):
+        self.prefix = prefix
+        self.span = span
+        self.retention = retention_days * 86400
+        self.schema = schema  # 建表语句列表，{table} 为表名占位符
+        self._known = set()   # 已确认存在的表，省去每次写入的 CREATE IF NOT EXISTS
+        TimePartitions._instances.append(self)
+
+    @classmethod
+    def forget_created(cls):
+        """事务回滚后调用：回滚前建的表可能已不存在，清空缓存，下次写入时重新建表"""
+        for parts in cls._instances:
+            parts._known.clear()
+
+    def start_of(self, epoch):
+        return int(epoch) // self.span * self.span
+
+    def table_for(self, epoch):
+        day = datetime.fromtimestamp(self.start_of(epoch), tz=timezone.utc)
+        return f"{self.prefix}_p{day.strftime('%Y%m%d')}"
+
+    def ensure(self, conn, table):
+        if table not in self._known:
+            self.create(conn, table)
+
+    def create(self, conn, table):
+        """执行建表和建索引语句（均为 IF NOT EXISTS），不检查缓存"""
+        for statement in self.schema:
+            conn.execute(statement.format(table=table))
+        self._known.add(table)
+
+    def partitions(self, conn):
+        """返回 [(分区起始 epoch, 表名), ...]，按时间升序"""
+        rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?",
+                            (f'{self.prefix}_p[0-9]*',)).fetchall()
+        result = []
+        for row in rows:
+            day = datetime.strptime(row['name'][len(self.prefix) + 2:], '%Y%m%d').replace(tzinfo=timezone.utc)
+            result.append((int(day.timestamp()), row['name']))
+        return sorted(result)
+
+    def overlapping(self, conn, start=None, end=None):
+        """与 [start, end] 有交集的分区 [(分区起始 epoch, 表名), ...]，按时间升序"""
+        return [(part_start, table) for part_start, table in self.partitions(conn)
+                if (end is None or part_start <= end) and (start is None or part_start + self.span > start)]
+
+    def drop(self, conn, table):
+        conn.execute(f'DROP TABLE IF EXISTS {table}')
+        self._known.discard(table)
+
+    def drop_expired(self, conn, now):
+        """删除整体早于保留期的分区，返回被删除的表名"""
+        if self.retention <= 0:
+            return []
+        cutoff = now - self.retention
+        dropped = []
+        for part_start, table in self.partitions(conn):
+            if part_start + self.span <= cutoff:
+                self.drop(conn, table)
+                dropped.append(table)
+        return dropped
+
+raw_partitions = TimePartitions('metrics', RAW_PARTITION_SPAN, RETENTION_RAW_DAYS, [
+    '''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            host_id INTEGER NOT NULL,
+            cpu_usage REAL,
+            memory_usage REAL,
+            memory_total REAL,
+            memory_used REAL,
+            disk_usage REAL,
+            load1 REAL,
+            load5 REAL,
+            load15 REAL,
+            data_source TEXT DEFAULT 'real',  -- real: 真实数据, simulated: 模拟数据
+            timestamp INTEGER NOT NULL,       -- 采样时间（epoch 毫秒）
+            FOREIGN KEY (host_id) REFERENCES hosts (id)
+        )
+    ''',
+    # 按主机查询时间范围、删除主机数据都走这个索引
+    'CREATE INDEX IF NOT EXISTS idx_{table}_host_ts ON {table} (host_id, timestamp)'
+])
+
+# 旧格式（文本时间戳 + load_avg JSON）的原始分区，启动时改名到这里，后台分批转换到新格式后删除
+legacy_partitions = TimePartitions('legacy_metrics', RAW_PARTITION_SPAN, RETENTION_RAW_DAYS, [])
+
+# 已结束的原始分区压缩后的数据块：每台主机每个指标一串 Gorilla 编码的 BLOB，与原始数据共用保留期
+chunk_partitions = TimePartitions('chunks', RAW_PARTITION_SPAN, RETENTION_RAW_DAYS, [
+    '''
+        CREATE TABLE IF NOT EXISTS {table} (
+            host_id INTEGER NOT NULL,
+            metric TEXT NOT NULL,
+            seq INTEGER NOT NULL,         -- 块内第一个样本在该主机当天样本中的序号
+            start_ts INTEGER NOT NULL,    -- 块内第一个/最后一个样本时间（epoch 毫秒）
+            end_ts INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            data_source TEXT,
+            data BLOB NOT NULL,
+            PRIMARY KEY (host_id, metric, seq)
+        )
+    '''
+])
+
+ROLLUP_COLUMN_DEFS = ',\n'.join(f'            {column} REAL' for column in ROLLUP_COLUMNS)
+
+# 降采样汇总：每种分辨率一组分区，每台主机每个时间桶一行，随写入增量维护
+rollup_partitions = {
+    resolution: TimePartitions(f'rollup{resolution}', ROLLUP_PARTITION_SPANS[resolution],
+                               RETENTION_DAYS_BY_RESOLUTION[resolution], [f'''
+        CREATE TABLE IF NOT EXISTS {{table}} (
+            host_id INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,  -- 桶起始时间（epoch 秒）
+{ROLLUP_COLUMN_DEFS},
+            PRIMARY KEY (host_id, bucket)
+        ) WITHOUT ROWID
+    '''])
+    for resolution in ROLLUP_RESOLUTIONS
+}
+
+def all_partition_sets():
+    return [raw_partitions, legacy_partitions, chunk_partitions, *rollup_partitions.values()]
+
 def init_db():
-    conn = get_db()
-    cursor = conn.cursor()
+    with get_db() as conn:
+        create_tables(conn.cursor())
+    migrate_legacy_tables()
+    detach_legacy_partitions()
+
+def create_tables(cursor):
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS hosts (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -88,86 +366,1092 @@ def init_db():
             password TEXT NOT NULL,
             port INTEGER DEFAULT 22,
             name TEXT,
-            host_type TEXT DEFAULT 'real',  -- real: 真实主机, simulated: 模拟主机
+            host_type TEXT DEFAULT 'real',  -- real: 真实主机, simulated: 模拟主机, push: Agent推送主机
+            collect_interval INTEGER,       -- 采集间隔（秒），为空时使用全局 COLLECT_INTERVAL
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS metrics (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            host_id INTEGER NOT NULL,
-            cpu_usage REAL,
-            memory_usage REAL,
-            memory_total REAL,
-            memory_used REAL,
-            disk_usage REAL,
-            load_avg TEXT,
-            data_source TEXT DEFAULT 'real',  -- real: 真实数据, simulated: 模拟数据
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (host_id) REFERENCES hosts (id)
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-init_db()
-
-def add_host(ip, username, password, port=22, name="", host_type="real"):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO hosts (ip, username, password, port, name, host_type) VALUES (?, ?, ?, ?, ?, ?)',
-                   (ip, username, password, port, name, host_type))
-    host_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    # 旧版本数据库补齐新增的列
+    ensure_column(cursor, 'hosts', 'collect_interval', 'INTEGER')
+    # 分页按 (排序列, id) 比较游标，排序列不能为 NULL
+    cursor.execute("UPDATE hosts SET name = '' WHERE name IS NULL")
+    for index, columns in HOST_INDEXES.items():
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {index} ON hosts ({columns})')
+
+def ensure_column(cursor, table, column, definition):
+    columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})').fetchall()]
+    if column not in columns:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+def table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+def migrate_legacy_tables():
+    """旧版本的单表 metrics 改名为 legacy_metrics（只改表名，启动时瞬间完成），由后台分批转换到按天分区；
+    metrics_rollup 按分区拆分迁移，每个分区一个事务，迁移完成后删除旧表"""
+    with get_db() as conn:
+        if table_exists(conn, 'metrics') and not table_exists(conn, LEGACY_METRICS_TABLE):
+            conn.execute(f'ALTER TABLE metrics RENAME TO {LEGACY_METRICS_TABLE}')
+            print(f"旧 metrics 表已改名为 {LEGACY_METRICS_TABLE}，将在后台转换到按天分区")
+        has_rollup = table_exists(conn, 'metrics_rollup')
+
+    if has_rollup:
+        rollup_columns = ', '.join(ROLLUP_COLUMNS)
+        for resolution, parts in rollup_partitions.items():
+            with get_db() as conn:
+                starts = [row[0] for row in conn.execute(
+                    'SELECT DISTINCT bucket / ? * ? FROM metrics_rollup WHERE resolution = ?',
+                    (parts.span, parts.span, resolution)).fetchall()]
+            for part_start in starts:
+                table = parts.table_for(part_start)
+                with get_db() as conn:
+                    parts.ensure(conn, table)
+                    conn.execute(f'''
+                        INSERT OR REPLACE INTO {table} (host_id, bucket, {rollup_columns})
+                        SELECT host_id, bucket, {rollup_columns} FROM metrics_rollup
+                        WHERE resolution = ? AND bucket >= ? AND bucket < ?
+                    ''', (resolution, part_start, part_start + parts.span))
+        with get_db() as conn:
+            conn.execute('DROP TABLE metrics_rollup')
+        print("已将旧 metrics_rollup 表迁移到汇总分区")
+
+# 新格式的列，以及从旧格式行换算出这些列的表达式
+RAW_COLUMN_NAMES = ('host_id', 'cpu_usage', 'memory_usage', 'memory_total', 'memory_used', 'disk_usage',
+                    'load1', 'load5', 'load15', 'data_source', 'timestamp')
+LEGACY_RAW_EXPRESSIONS = {
+    'load1': "json_extract(load_avg, '$[0]')",
+    'load5': "json_extract(load_avg, '$[1]')",
+    'load15': "json_extract(load_avg, '$[2]')",
+    'timestamp': "CAST(strftime('%s', timestamp) AS INTEGER) * 1000",
+}
+RAW_COLUMNS = ', '.join(RAW_COLUMN_NAMES)
+LEGACY_METRICS_TABLE = 'legacy_metrics'  # 旧版本未分区的 metrics 表改名后的表名
+LEGACY_RAW_SELECT = ', '.join(LEGACY_RAW_EXPRESSIONS.get(column, column) for column in RAW_COLUMN_NAMES)
+
+def detach_legacy_partitions():
+    """把旧格式的原始分区改名为 legacy_metrics_pYYYYMMDD 并建好同名的新格式分区
+
+    只改表名，不搬数据，启动时瞬间完成；数据由 migrate_legacy_partitions() 在后台分批转换。
+    """
+    with get_db() as conn:
+        for part_start, table in raw_partitions.partitions(conn):
+            columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table})').fetchall()]
+            if 'load_avg' in columns:
+                conn.execute(f'ALTER TABLE {table} RENAME TO {legacy_partitions.table_for(part_start)}')
+                raw_partitions.ensure(conn, table)
+
+def migrate_legacy_partitions():
+    """后台分批把旧格式数据转换到新格式分区，每批一个短事务，查询期间两边的数据都可见
+
+    搬运时不保留旧 id，由新格式分区重新分配：迁移期间新分区同时在接收新样本，
+    保留旧 id 会与新样本已经占用的 id 冲突。游标按 (时间戳, id) 比较，id 只需在分区内唯一。
+    """
+    # 早期压缩块的时间戳是秒，统一换算成毫秒
+    with get_db() as conn:
+        chunk_tables = chunk_partitions.partitions(conn)
+    for _, table in chunk_tables:
+        while True:
+            with get_db() as conn:
+                rows = conn.execute(f'''
+                    SELECT host_id, metric, seq, count, data FROM {table}
+                    WHERE start_ts < ? LIMIT ?
+                ''', (SECONDS_TIMESTAMP_LIMIT, MIGRATION_BATCH_SIZE)).fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    points = list(decode_chunk(row['data'], row['count']))
+                    timestamps = [ts * 1000 for ts, _ in points]
+                    conn.execute(f'''
+                        UPDATE {table} SET start_ts = ?, end_ts = ?, data = ?
+                        WHERE host_id = ? AND metric = ? AND seq = ?
+                    ''', (timestamps[0], timestamps[-1], encode_chunk(timestamps, [v for _, v in points]),
+                          row['host_id'], row['metric'], row['seq']))
+            time.sleep(MIGRATION_PAUSE)
+
+    # 旧版本的单表 metrics：按 id 分批读出，按样本时间写入对应的新格式分区
+    moved = 0
+    while True:
+        with get_db() as conn:
+            if not table_exists(conn, LEGACY_METRICS_TABLE):
+                break
+            rows = conn.execute(f'''
+                SELECT id, {LEGACY_RAW_SELECT} FROM {LEGACY_METRICS_TABLE} ORDER BY id LIMIT ?
+            ''', (MIGRATION_BATCH_SIZE,)).fetchall()
+            if not rows:
+                conn.execute(f'DROP TABLE {LEGACY_METRICS_TABLE}')
+                print(f"已将旧 metrics 表转换到按天分区: {moved} 条样本")
+                break
+            groups = {}
+            for row in rows:
+                values = tuple(row)[1:]
+                timestamp_ms = values[-1]
+                # 时间戳无法解析的行无法归入分区，随旧表一起丢弃
+                if timestamp_ms is not None:
+                    groups.setdefault(raw_partitions.table_for(timestamp_ms / 1000), []).append(values)
+            for table, values in groups.items():
+                raw_partitions.ensure(conn, table)
+                conn.executemany(METRICS_INSERT_SQL.format(table=table), values)
+            conn.execute(f'DELETE FROM {LEGACY_METRICS_TABLE} WHERE id <= ?', (rows[-1]['id'],))
+            moved += len(rows)
+        time.sleep(MIGRATION_PAUSE)
+
+    with get_db() as conn:
+        legacy = legacy_partitions.partitions(conn)
+    for part_start, table in legacy:
+        target = raw_partitions.table_for(part_start)
+        moved = 0
+        while True:
+            with get_db() as conn:
+                raw_partitions.ensure(conn, target)
+                ids = [row[0] for row in conn.execute(
+                    f'SELECT id FROM {table} ORDER BY id LIMIT ?', (MIGRATION_BATCH_SIZE,)).fetchall()]
+                if not ids:
+                    legacy_partitions.drop(conn, table)
+                    # 改名后的旧表沿用了 idx_{target}_host_ts 这个索引名，新分区建表时的 CREATE INDEX IF NOT EXISTS
+                    # 因此什么都没做；旧表删除后补建索引
+                    raw_partitions.create(conn, target)
+                    break
+                conn.execute(f'''
+                    INSERT INTO {target} ({RAW_COLUMNS})
+                    SELECT {LEGACY_RAW_SELECT} FROM {table} WHERE id >= ? AND id <= ? ORDER BY id
+                ''', (ids[0], ids[-1]))
+                conn.execute(f'DELETE FROM {table} WHERE id <= ?', (ids[-1],))
+                moved += len(ids)
+            time.sleep(MIGRATION_PAUSE)
+        print(f"已将旧格式分区 {table} 转换为新格式: {moved} 条样本")
+
+def apply_retention(now=None):
+    """整表删除所有过期分区"""
+    now = now or time.time()
+    dropped = []
+    with get_db() as conn:
+        for parts in all_partition_sets():
+            dropped.extend(parts.drop_expired(conn, now))
+    if dropped:
+        print(f"已删除过期分区 {len(dropped)} 个: {', '.join(dropped)}")
+    return dropped
+
+def maintenance_loop():
+    """后台维护：先完成旧格式数据迁移，之后定期压缩已结束的分区、清理过期分区"""
+    try:
+        migrate_legacy_partitions()
+    except Exception as e:
+        print(f"旧格式数据迁移失败: {str(e)}")
+    while True:
+        try:
+            compact_closed_partitions()
+            apply_retention()
+        except Exception as e:
+            print(f"清理过期分区失败: {str(e)}")
+        time.sleep(RETENTION_CHECK_INTERVAL)
+
+# 只读模式（离线导出）不建表、不迁移，不改动正在被服务使用的数据库
+if not DATABASE_READONLY:
+    init_db()
+
+class HostRegistry:
+    """hosts 表的进程内缓存，按 id 和 ip 建索引
+
+    首次使用时整表读入，之后由 add_host / delete_host 等写入函数在提交后同步更新，
+    只有 invalidate() 之后才会重新读库。每次变更 generation 加一，依赖主机列表的
+    缓存（如监控大屏）据此判断是否需要重建。缓存中的主机 dict 视为只读：
+    变更时整条替换，调度器才能通过新旧对象比较发现间隔变化。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_id = None      # None 表示需要从库加载
+        self._by_ip = {}        # ip -> {host_id: host}，同一 IP 可以有多个端口
+        self._list = None       # all() 的结果，变更后置空，下次读取时重建
+        self._simulated_ip_high = 0  # 已分配过的最大模拟地址（整数），删除主机时不回退
+        self.generation = 0
+
+    def _load(self):
+        with get_db() as conn:
+            rows = [dict(row) for row in conn.execute('SELECT * FROM hosts')]
+        by_id, by_ip = {}, {}
+        self._simulated_ip_high = 0
+        for host in rows:
+            by_id[host['id']] = host
+            by_ip.setdefault(host['ip'], {})[host['id']] = host
+            self._track_simulated_ip(host['ip'])
+        self._by_ip = by_ip
+        self._by_id = by_id
+        self._list = None
+
+    def _ensure_loaded(self):
+        if self._by_id is None:
+            with self._lock:
+                if self._by_id is None:
+                    self._load()
+        return self._by_id
+
+    def _track_simulated_ip(self, ip):
+        try:
+            value = int(ipaddress.IPv4Address(ip))
+        except ValueError:
+            return
+        if int(SIMULATED_IP_FIRST) <= value <= int(SIMULATED_IP_LAST):
+            self._simulated_ip_high = max(self._simulated_ip_high, value)
+
+    def invalidate(self):
+        with self._lock:
+            self._by_id = None
+            self._list = None
+            self.generation += 1
+
+    def all(self):
+        """所有主机，按创建时间倒序"""
+        hosts = self._list
+        if hosts is None:
+            with self._lock:
+                if self._by_id is None:
+                    self._load()
+                if self._list is None:
+                    self._list = sorted(self._by_id.values(), key=lambda h: (h['created_at'] or '', h['id']), reverse=True)
+                hosts = self._list
+        return hosts
+
+    def get(self, host_id):
+        return self._ensure_loaded().get(host_id)
+
+    def by_ip(self, ip):
+        self._ensure_loaded()
+        return list(self._by_ip.get(ip, {}).values())
+
+    def simulated_ip_high_water(self):
+        """已分配过的最大模拟地址（整数），没有时为 0"""
+        self._ensure_loaded()
+        return self._simulated_ip_high
+
+    def put(self, hosts):
+        """新增或替换主机（完整的行）"""
+        with self._lock:
+            if self._by_id is not None:
+                for host in hosts:
+                    old = self._by_id.get(host['id'])
+                    if old is not None and old['ip'] != host['ip']:
+                        self._by_ip.get(old['ip'], {}).pop(host['id'], None)
+                    self._by_id[host['id']] = host
+                    self._by_ip.setdefault(host['ip'], {})[host['id']] = host
+                    self._track_simulated_ip(host['ip'])
+                self._list = None
+            self.generation += 1
+
+    def remove(self, host_id):
+        with self._lock:
+            if self._by_id is not None:
+                host = self._by_id.pop(host_id, None)
+                if host is not None:
+                    ips = self._by_ip.get(host['ip'], {})
+                    ips.pop(host_id, None)
+                    if not ips:
+                        self._by_ip.pop(host['ip'], None)
+                self._list = None
+            self.generation += 1
+
+host_registry = HostRegistry()
+
+def add_host(ip, username, password, port=22, name="", host_type="real", collect_interval=None):
+    # 分页按 (排序列, id) 比较游标，name 不能写入 NULL
+    name = '' if name is None else str(name)
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO hosts (ip, username, password, port, name, host_type, collect_interval) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (ip, username, password, port, name, host_type, collect_interval))
+        host_id = cursor.lastrowid
+        host = dict(cursor.execute('SELECT * FROM hosts WHERE id = ?', (host_id,)).fetchone())
+    host_registry.put([host])
     return host_id
 
+HOST_INSERT_SQL = '''
+    INSERT INTO hosts (ip, username, password, port, name, host_type, collect_interval)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+def insert_hosts(conn, rows):
+    """executemany 批量插入主机并返回新主机列表（需在 BEGIN IMMEDIATE 事务内调用）"""
+    last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM hosts').fetchone()[0]
+    sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'hosts'").fetchone()
+    last_id = max(last_id, sequence[0] if sequence else 0)
+    conn.executemany(HOST_INSERT_SQL, rows)
+    # 持有写锁期间 AUTOINCREMENT 只会分配给本事务，id 大于 last_id 的就是新插入的主机
+    cursor = conn.execute('SELECT * FROM hosts WHERE id > ? ORDER BY id', (last_id,))
+    return [dict(row) for row in cursor.fetchall()]
+
+def add_hosts_many(rows):
+    """一个事务内批量添加主机，rows 为 (ip, username, password, port, name, host_type, collect_interval)"""
+    with get_db() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        hosts = insert_hosts(conn, rows)
+    host_registry.put(hosts)
+    return hosts
+
+def add_simulated_hosts(names):
+    """批量添加模拟主机，IP 在同一事务内分配，不会与已有主机冲突"""
+    with get_db() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        ips = allocate_simulated_ips(conn, len(names))
+        rows = [(ip, 'simulated', 'simulated', 22, name, 'simulated', None) for ip, name in zip(ips, names)]
+        hosts = insert_hosts(conn, rows)
+    host_registry.put(hosts)
+    return hosts
+
+def allocate_simulated_ips(conn, count):
+    """从上次分配到的最大模拟地址之后顺序分配回环地址（需在写事务内调用）
+
+    起点取自 host_registry 维护的高水位，只按 ip 索引检查候选地址是否已被占用；
+    分配到 127.255.255.254 后回到 127.0.0.100 重新查找空闲地址。
+    """
+    first, last = int(SIMULATED_IP_FIRST), int(SIMULATED_IP_LAST)
+    high = host_registry.simulated_ip_high_water()
+    current = high + 1 if high else first
+    ips = []
+    wrapped = False
+    while len(ips) < count:
+        if current > last:
+            if wrapped:
+                raise ValueError('模拟主机地址已用尽')
+            current, wrapped = first, True
+        size = min(count - len(ips), SIMULATED_IP_CHECK_BATCH, last - current + 1)
+        candidates = [str(ipaddress.IPv4Address(value)) for value in range(current, current + size)]
+        taken = {row[0] for row in conn.execute(
+            f"SELECT ip FROM hosts WHERE ip IN ({', '.join('?' for _ in candidates)})", candidates)}
+        ips.extend(ip for ip in candidates if ip not in taken)
+        current += size
+    return ips
+
+def set_host_interval(host_id, collect_interval):
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('UPDATE hosts SET collect_interval = ? WHERE id = ?', (collect_interval, host_id))
+        updated = cursor.rowcount > 0
+    host = host_registry.get(host_id)
+    if updated and host is not None:
+        host_registry.put([{**host, 'collect_interval': collect_interval}])
+    elif updated:
+        host_registry.invalidate()
+    return updated
+
 def delete_host(host_id):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM metrics WHERE host_id = ?', (host_id,))
-    cursor.execute('DELETE FROM hosts WHERE id = ?', (host_id,))
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        cursor = conn.cursor()
+        for parts in all_partition_sets():
+            for _, table in parts.partitions(conn):
+                cursor.execute(f'DELETE FROM {table} WHERE host_id = ?', (host_id,))
+        if table_exists(conn, LEGACY_METRICS_TABLE):
+            cursor.execute(f'DELETE FROM {LEGACY_METRICS_TABLE} WHERE host_id = ?', (host_id,))
+        cursor.execute('DELETE FROM hosts WHERE id = ?', (host_id,))
+    host_registry.remove(host_id)
 
 def get_all_hosts():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM hosts ORDER BY created_at DESC')
-    hosts = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return hosts
+    """所有主机（来自 host_registry 缓存，返回的 dict 不要修改）"""
+    return host_registry.all()
 
-def save_metrics(host_id, metrics, data_source="real"):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO metrics 
-        (host_id, cpu_usage, memory_usage, memory_total, memory_used, disk_usage, load_avg, data_source)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
+HOST_SORT_FIELDS = ('created_at', 'id', 'name', 'ip')
+HOST_PAGE_MAX_LIMIT = 1000
+
+def host_filter_sql(host_type=None, name_prefix=None):
+    clauses, params = [], []
+    if host_type:
+        clauses.append('host_type = ?')
+        params.append(host_type)
+    if name_prefix:
+        # 前缀用范围条件表示，可以走 name 索引（LIKE 默认不区分大小写，用不上索引）
+        clauses.append('name >= ? AND name < ?')
+        params.extend((name_prefix, name_prefix + '\U0010ffff'))
+    return clauses, params
+
+def query_hosts_page(host_type=None, name_prefix=None, sort='created_at', descending=True,
+                     limit=50, offset=0, after=None):
+    """按主机表字段分页，after 为上一页最后一行的 (排序值, id)，返回 (主机列表, 总数, 下一页游标)
+
+    游标为 [排序字段, 排序值, id]，见 cursor_position()。
+    """
+    clauses, params = host_filter_sql(host_type, name_prefix)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    with get_db() as conn:
+        total = conn.execute(f'SELECT COUNT(*) FROM hosts {where}', params).fetchone()[0]
+        page_clauses, page_params = list(clauses), list(params)
+        if after is not None:
+            page_clauses.append(f"({sort}, id) {'<' if descending else '>'} (?, ?)")
+            page_params.extend(after)
+        page_where = f"WHERE {' AND '.join(page_clauses)}" if page_clauses else ''
+        direction = 'DESC' if descending else 'ASC'
+        rows = conn.execute(
+            f'SELECT * FROM hosts {page_where} ORDER BY {sort} {direction}, id {direction} LIMIT ? OFFSET ?',
+            page_params + [limit + 1, offset]
+        ).fetchall()
+    hosts = [dict(row) for row in rows[:limit]]
+    next_cursor = encode_cursor(sort, hosts[-1][sort], hosts[-1]['id']) if len(rows) > limit else None
+    return hosts, total, next_cursor
+
+def get_hosts_by_ids(host_ids):
+    """按给定顺序返回主机"""
+    hosts = (host_registry.get(host_id) for host_id in host_ids)
+    return [host for host in hosts if host is not None]
+
+METRICS_INSERT_SQL = f'''
+    INSERT INTO {{table}} ({RAW_COLUMNS})
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def sample_time_ms(metrics, default):
+    """样本自带的采集时间（epoch 秒）换算为毫秒，缺失或无效时使用 default"""
+    try:
+        return int(round(float(metrics.get('timestamp') or default) * 1000))
+    except (TypeError, ValueError):
+        return int(round(default * 1000))
+
+def metrics_row(host_id, metrics, data_source, timestamp_ms):
+    loads = metrics.get('load_avg') or []
+    return (
         host_id,
         metrics.get('cpu_usage'),
         metrics.get('memory_usage'),
         metrics.get('memory_total'),
         metrics.get('memory_used'),
         metrics.get('disk_usage'),
-        json.dumps(metrics.get('load_avg', [])),
-        data_source
-    ))
-    conn.commit()
-    conn.close()
+        *(loads[i] if len(loads) > i else None for i in range(3)),
+        data_source,
+        timestamp_ms
+    )
 
-# === 真实SSH数据采集 ===
-def collect_real_metrics(host):
-    """通过SSH采集真实服务器监控数据"""
-    try:
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
+def save_metrics(host_id, metrics, data_source="real"):
+    save_metrics_many([(host_id, metrics, data_source)])
+
+def save_metrics_many(items):
+    """批量写入 [(host_id, metrics, data_source), ...]，原始数据和汇总表在一个事务中提交"""
+    if not items:
+        return
+    # 原始数据和汇总数据都按样本自身的采集时间进入对应分区
+    now = time.time()
+    raw_groups = {}
+    for host_id, metrics, data_source in items:
+        timestamp_ms = sample_time_ms(metrics, now)
+        raw_groups.setdefault(raw_partitions.table_for(timestamp_ms / 1000), []).append(
+            metrics_row(host_id, metrics, data_source, timestamp_ms))
+    rollup_groups = {}
+    for host_id, resolution, bucket, *values in aggregate_rollups(items):
+        parts = rollup_partitions[resolution]
+        table = parts.table_for(bucket)
+        rollup_groups.setdefault(table, (parts, []))[1].append((host_id, bucket, *values))
+
+    with get_db() as conn:
+        for table, rows in raw_groups.items():
+            raw_partitions.ensure(conn, table)
+            conn.executemany(METRICS_INSERT_SQL.format(table=table), rows)
+        for table, (parts, rows) in rollup_groups.items():
+            parts.ensure(conn, table)
+            conn.executemany(ROLLUP_UPSERT_SQL.format(table=table), rows)
+
+# 历史查询可返回的字段
+HISTORY_FIELDS = ('cpu_usage', 'memory_usage', 'memory_total', 'memory_used', 'disk_usage', 'load_avg', 'data_source')
+HISTORY_DEFAULT_LIMIT = 500
+HISTORY_MAX_LIMIT = 5000
+
+def encode_cursor(*parts):
+    return base64.urlsafe_b64encode(json.dumps(parts).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+
+def history_cursor(cursor, resolution):
+    """检查历史查询游标：原始数据为 [毫秒时间戳, id]，汇总数据为 [桶起始时间]，不匹配时抛出 ValueError"""
+    size = 2 if resolution == 'raw' else 1
+    if (not isinstance(cursor, list) or len(cursor) != size
+            or not all(isinstance(part, int) and not isinstance(part, bool) for part in cursor)):
+        raise ValueError('cursor 与当前的分辨率不匹配，请从第一页重新开始')
+    return cursor
+
+def query_metrics_history(host_id, start=None, end=None, fields=HISTORY_FIELDS, limit=HISTORY_DEFAULT_LIMIT, after=None):
+    """start/end 为 epoch 秒，after 为上一页最后一行的 (毫秒时间戳, id)
+
+    按时间顺序依次扫描与范围重叠的分区，凑够一页即停止：未压缩的分区走 (host_id, timestamp) 索引，
+    已压缩的分区顺序解码数据块，尚未迁移完的旧格式分区与新格式分区合并查询；
+    旧版本未分区的 legacy_metrics 表转换完成前整体作为一个数据源，按文本时间戳过滤后合并。
+    所有查询在一个读事务内完成，后台迁移批次提交前后的数据不会重复或遗漏。
+    返回 (数据点列表, 下一页游标或 None)
+    """
+    start_ms = int(start * 1000) if start is not None else None
+    end_ms = int(end * 1000) if end is not None else None
+    after = (int(after[0]), int(after[1])) if after else None
+
+    columns = []
+    for field in fields:
+        columns.extend(LOAD_SERIES if field == 'load_avg' else [field])
+    conditions = ['host_id = ?']
+    params = [host_id]
+    legacy_conditions = ['host_id = ?']
+    legacy_params = [host_id]
+    if start_ms is not None:
+        conditions.append('timestamp >= ?')
+        params.append(start_ms)
+        legacy_conditions.append('timestamp >= ?')
+        legacy_params.append(to_db_timestamp(start))
+    if end_ms is not None:
+        conditions.append('timestamp <= ?')
+        params.append(end_ms)
+        legacy_conditions.append('timestamp <= ?')
+        legacy_params.append(to_db_timestamp(end))
+    if after:
+        conditions.append('(timestamp, id) > (?, ?)')
+        params.extend(after)
+        legacy_conditions.append(f"({LEGACY_RAW_EXPRESSIONS['timestamp']}, id) > (?, ?)")
+        legacy_params.extend(after)
+
+    select = f"SELECT id, timestamp, {', '.join(columns)} FROM {{table}} WHERE {' AND '.join(conditions)}"
+    # 与新格式分区 UNION 时列名取自前一个 SELECT；单独查询时按别名读取，时间戳别名为 ts，避免遮住文本时间戳列
+    legacy_columns = ', '.join([f"{LEGACY_RAW_EXPRESSIONS['timestamp']} AS ts",
+                                *(f'{LEGACY_RAW_EXPRESSIONS.get(column, column)} AS {column}' for column in columns)])
+    legacy_select = f"SELECT id, {legacy_columns} FROM {{legacy}} WHERE {' AND '.join(legacy_conditions)}"
+
+    # 游标之前的分区不必再扫描
+    scan_start = max(start or 0, after[0] / 1000) if after else start
+    results = []  # [((毫秒时间戳, id), 数据点), ...]
+    with get_db() as conn:
+        conn.execute('BEGIN')
+        raw_tables = dict(raw_partitions.overlapping(conn, scan_start, end))
+        legacy_tables = dict(legacy_partitions.overlapping(conn, scan_start, end))
+        chunk_tables = dict(chunk_partitions.overlapping(conn, scan_start, end))
+        for part_start in sorted(set(raw_tables) | set(legacy_tables) | set(chunk_tables)):
+            remaining = limit + 1 - len(results)
+            sources = []
+            if part_start in raw_tables:
+                sql = select.format(table=raw_tables[part_start])
+                sql_params = list(params)
+                if part_start in legacy_tables:
+                    sql += ' UNION ALL ' + legacy_select.format(legacy=legacy_tables[part_start])
+                    sql_params += legacy_params
+                rows = conn.execute(f'{sql} ORDER BY timestamp, id LIMIT ?', sql_params + [remaining]).fetchall()
+                sources.append([((row['timestamp'], row['id']), history_point(row['timestamp'], dict(row), fields))
+                                for row in rows])
+            if part_start in chunk_tables:
+                # 已压缩的一天又收到迟到的样本时，原始分区和数据块同时存在，按游标顺序合并
+                sources.append(read_chunk_points(conn, chunk_tables[part_start], host_id, start_ms, end_ms, fields, after))
+            results.extend(itertools.islice(heapq.merge(*sources, key=lambda item: item[0]), remaining))
+            if len(results) > limit:
+                break
+        if table_exists(conn, LEGACY_METRICS_TABLE):
+            rows = conn.execute(f"{legacy_select.format(legacy=LEGACY_METRICS_TABLE)} AND ts IS NOT NULL ORDER BY ts, id LIMIT ?",
+                                legacy_params + [limit + 1]).fetchall()
+            legacy_points = [((row['ts'], row['id']), history_point(row['ts'], dict(row), fields)) for row in rows]
+            results = list(itertools.islice(heapq.merge(results, legacy_points, key=lambda item: item[0]), limit + 1))
+
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = encode_cursor(*results[-1][0])
+    return [point for _, point in results], next_cursor
+
+def history_point(timestamp_ms, values, fields):
+    """按请求字段组装数据点，load1/5/15 合并回 load_avg 列表"""
+    point = {'timestamp': timestamp_ms / 1000}
+    for field in fields:
+        if field == 'load_avg':
+            point[field] = [values[name] for name in LOAD_SERIES if values.get(name) is not None]
+        else:
+            point[field] = values.get(field)
+    return point
+
+# === 压缩块存储 ===
+# 每个指标一条序列；load_avg 拆成三条，NULL 以 NaN 编码，保证同一主机各序列的样本一一对应
+CHUNK_SERIES = ('cpu_usage', 'memory_usage', 'memory_total', 'memory_used', 'disk_usage', 'load1', 'load5', 'load15')
+LOAD_SERIES = ('load1', 'load5', 'load15')
+
+class BitWriter:
+    def __init__(self):
+        self._buf = bytearray()
+        self._acc = 0
+        self._nbits = 0
+
+    def write(self, value, nbits):
+        self._acc = (self._acc << nbits) | (value & ((1 << nbits) - 1))
+        self._nbits += nbits
+        while self._nbits >= 8:
+            self._nbits -= 8
+            self._buf.append((self._acc >> self._nbits) & 0xFF)
+        self._acc &= (1 << self._nbits) - 1
+
+    def getvalue(self):
+        if self._nbits:
+            return bytes(self._buf) + bytes([(self._acc << (8 - self._nbits)) & 0xFF])
+        return bytes(self._buf)
+
+class BitReader:
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+        self._acc = 0
+        self._nbits = 0
+
+    def read(self, nbits):
+        while self._nbits < nbits:
+            self._acc = (self._acc << 8) | self._data[self._pos]
+            self._pos += 1
+            self._nbits += 8
+        self._nbits -= nbits
+        value = self._acc >> self._nbits
+        self._acc &= (1 << self._nbits) - 1
+        return value
+
+def _signed(value, nbits):
+    return value - (1 << nbits) if value >= 1 << (nbits - 1) else value
+
+def _float_bits(value):
+    return struct.unpack('>Q', struct.pack('>d', float('nan') if value is None else value))[0]
+
+def _bits_float(bits):
+    value = struct.unpack('>d', struct.pack('>Q', bits))[0]
+    return None if value != value else value
+
+# 时间戳二阶差分的分档：(前缀, 前缀位数, 数值位数)
+DOD_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12))
+
+def encode_chunk(timestamps, values):
+    """Gorilla 编码：时间戳存二阶差分，数值存与前一个值的 XOR，只写有效位"""
+    writer = BitWriter()
+    writer.write(timestamps[0], 64)
+    prev_bits = _float_bits(values[0])
+    writer.write(prev_bits, 64)
+    prev_ts, prev_delta = timestamps[0], 0
+    prev_lead = prev_trail = -1
+
+    for ts, value in zip(timestamps[1:], values[1:]):
+        delta = ts - prev_ts
+        dod = delta - prev_delta
+        prev_ts, prev_delta = ts, delta
+        if dod == 0:
+            writer.write(0, 1)
+        else:
+            for prefix, prefix_bits, value_bits in DOD_BUCKETS:
+                if -(1 << (value_bits - 1)) <= dod < 1 << (value_bits - 1):
+                    writer.write(prefix, prefix_bits)
+                    writer.write(dod, value_bits)
+                    break
+            else:
+                writer.write(0b1111, 4)
+                writer.write(dod, 64)
+
+        bits = _float_bits(value)
+        xor = bits ^ prev_bits
+        prev_bits = bits
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        lead = min(64 - xor.bit_length(), 31)
+        trail = (xor & -xor).bit_length() - 1
+        if prev_lead >= 0 and lead >= prev_lead and trail >= prev_trail:
+            # 有效位落在上一个窗口内，沿用窗口
+            writer.write(0b10, 2)
+            writer.write(xor >> prev_trail, 64 - prev_lead - prev_trail)
+        else:
+            meaningful = 64 - lead - trail
+            writer.write(0b11, 2)
+            writer.write(lead, 5)
+            writer.write(meaningful, 6)  # 64 写作 0
+            writer.write(xor >> trail, meaningful)
+            prev_lead, prev_trail = lead, trail
+    return writer.getvalue()
+
+def decode_chunk(data, count):
+    """流式解码，逐个产出 (时间戳, 数值)"""
+    reader = BitReader(data)
+    ts = reader.read(64)
+    bits = reader.read(64)
+    yield ts, _bits_float(bits)
+    delta = lead = trail = 0
+    for _ in range(count - 1):
+        if reader.read(1):
+            for _, _, value_bits in DOD_BUCKETS:
+                if not reader.read(1):
+                    delta += _signed(reader.read(value_bits), value_bits)
+                    break
+            else:
+                delta += _signed(reader.read(64), 64)
+        ts += delta
+
+        if reader.read(1):
+            if reader.read(1):
+                lead = reader.read(5)
+                trail = 64 - lead - (reader.read(6) or 64)
+            bits ^= reader.read(64 - lead - trail) << trail
+        yield ts, _bits_float(bits)
+
+def build_chunks(host_id, rows):
+    """把一台主机按时间排好序的样本切成数据块，数据来源变化或超过 CHUNK_MAX_POINTS 时换新块"""
+    chunk_rows = []
+    begin = 0
+    while begin < len(rows):
+        stop = begin + 1
+        while (stop < len(rows) and stop - begin < CHUNK_MAX_POINTS
+               and rows[stop]['data_source'] == rows[begin]['data_source']):
+            stop += 1
+        run = rows[begin:stop]
+        timestamps = [row['timestamp'] for row in run]
+        for name in CHUNK_SERIES:
+            chunk_rows.append((host_id, name, begin, timestamps[0], timestamps[-1], len(run),
+                               run[0]['data_source'], encode_chunk(timestamps, [row[name] for row in run])))
+        begin = stop
+    return chunk_rows
+
+def load_chunk_rows(conn, table, host_id):
+    """把一台主机已有的数据块解码回样本行，用于与迟到的原始数据合并后重新压缩"""
+    chunks = {}
+    for row in conn.execute(f'SELECT metric, seq, count, data_source, data FROM {table} WHERE host_id = ?',
+                            (host_id,)).fetchall():
+        chunks.setdefault(row['seq'], {})[row['metric']] = row
+    rows = []
+    for seq in sorted(chunks):
+        group = chunks[seq]
+        first = group[CHUNK_SERIES[0]]
+        block = [{'timestamp': ts, 'data_source': first['data_source']}
+                 for ts, _ in decode_chunk(first['data'], first['count'])]
+        for name, row in group.items():
+            for sample, (_, value) in zip(block, decode_chunk(row['data'], row['count'])):
+                sample[name] = value
+        rows.extend(block)
+    return rows
+
+def drop_partition_if_empty(parts, table):
+    """在写锁内确认分区已经没有行后删除，返回剩余的行数"""
+    with get_db() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        remaining = conn.execute(f'SELECT count(*) FROM {table}').fetchone()[0]
+        if not remaining:
+            parts.drop(conn, table)
+    return remaining
+
+def compact_partition(part_start):
+    """把一个已结束的原始分区逐主机压缩成数据块，原始分区为空后再删除
+
+    每台主机的读取、写入数据块和删除原始行在同一个写事务内完成，查询要么读到原始行要么读到数据块；
+    该天已有数据块时（迟到的样本）解码后合并重写。压缩期间迟到的样本留在原始分区中，
+    分区不为空就不删除，由下一轮压缩合并。
+    """
+    raw_table = raw_partitions.table_for(part_start)
+    chunk_table = chunk_partitions.table_for(part_start)
+    with get_db() as conn:
+        chunk_partitions.ensure(conn, chunk_table)
+        host_ids = [row[0] for row in conn.execute(f'SELECT DISTINCT host_id FROM {raw_table}').fetchall()]
+
+    sample_count = 0
+    chunk_bytes = 0
+    for host_id in host_ids:
+        with get_db() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = [dict(row) for row in conn.execute(f'''
+                SELECT {', '.join(CHUNK_SERIES)}, data_source, timestamp
+                FROM {raw_table}
+                WHERE host_id = ?
+                ORDER BY timestamp, id
+            ''', (host_id,)).fetchall()]
+            sample_count += len(rows)
+            existing = load_chunk_rows(conn, chunk_table, host_id)
+            if existing:
+                rows = sorted(existing + rows, key=lambda row: row['timestamp'])
+            chunk_rows = build_chunks(host_id, rows)
+            conn.execute(f'DELETE FROM {chunk_table} WHERE host_id = ?', (host_id,))
+            conn.executemany(f'''
+                INSERT INTO {chunk_table}
+                (host_id, metric, seq, start_ts, end_ts, count, data_source, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', chunk_rows)
+            conn.execute(f'DELETE FROM {raw_table} WHERE host_id = ?', (host_id,))
+        chunk_bytes += sum(len(row[-1]) for row in chunk_rows)
+
+    late = drop_partition_if_empty(raw_partitions, raw_table)
+    print(f"已压缩分区 {raw_table}: {sample_count} 条样本 -> {chunk_bytes} 字节"
+          + (f"，{late} 条迟到样本留待下一轮压缩" if late else ""))
+
+def compact_closed_partitions(now=None):
+    """压缩结束超过 CHUNK_COMPACT_DELAY 秒的原始分区，旧格式数据尚未迁移完的分区先跳过"""
+    now = now or time.time()
+    with get_db() as conn:
+        legacy = {part_start for part_start, _ in legacy_partitions.partitions(conn)}
+        closed = [part_start for part_start, _ in raw_partitions.partitions(conn)
+                  if part_start + raw_partitions.span + CHUNK_COMPACT_DELAY <= now and part_start not in legacy]
+    for part_start in closed:
+        compact_partition(part_start)
+    return len(closed)
+
+def read_chunk_points(conn, table, host_id, start_ms, end_ms, fields, after=None):
+    """从压缩分区中按时间顺序产出 ((毫秒时间戳, 序号), 数据点)，只解码所需字段对应的序列
+
+    早期按秒编码、尚未迁移的数据块在读取时换算为毫秒。
+    翻页时结束时间早于游标的数据块整块跳过，不读取也不解码，每页只从游标所在的数据块开始解码。
+    """
+    series = [name for name in CHUNK_SERIES if name in fields or (name in LOAD_SERIES and 'load_avg' in fields)]
+    series = series or ['cpu_usage']  # 只要 data_source 时也需要一条序列提供时间戳
+    conditions = ['host_id = ?', f"metric IN ({', '.join('?' for _ in series)})"]
+    params = [host_id, *series]
+    low_ms = start_ms
+    if after:
+        low_ms = after[0] if low_ms is None else max(low_ms, after[0])
+    if low_ms is not None:
+        conditions.append(f'(CASE WHEN end_ts < {SECONDS_TIMESTAMP_LIMIT} THEN end_ts * 1000 ELSE end_ts END) >= ?')
+        params.append(low_ms)
+    if end_ms is not None:
+        conditions.append(f'(CASE WHEN start_ts < {SECONDS_TIMESTAMP_LIMIT} THEN start_ts * 1000 ELSE start_ts END) <= ?')
+        params.append(end_ms)
+
+    chunks = {}
+    for row in conn.execute(f'''
+        SELECT metric, seq, start_ts, count, data_source, data FROM {table}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY seq
+    ''', params).fetchall():
+        chunks.setdefault(row['seq'], {})[row['metric']] = row
+
+    for seq in sorted(chunks):
+        group = chunks[seq]
+        first = group[series[0]]
+        scale = 1000 if first['start_ts'] < SECONDS_TIMESTAMP_LIMIT else 1
+        decoders = {name: decode_chunk(row['data'], row['count']) for name, row in group.items()}
+        for index in range(first['count']):
+            values = {'data_source': first['data_source']}
+            for name, decoder in decoders.items():
+                ts, values[name] = next(decoder)
+            ts *= scale
+            if low_ms is not None and ts < low_ms:
+                continue
+            if end_ms is not None and ts > end_ms:
+                return
+            key = (ts, CHUNK_ORDINAL_BASE + seq + index)
+            if after and key <= after:
+                continue
+            yield key, history_point(ts, values, fields)
+
+# === 降采样汇总 ===
+def _rollup_merge(column, agg):
+    # 已有桶与本批数据合并；标量 min()/max() 遇到 NULL 会返回 NULL，用 coalesce 兜底
+    if agg in ('sum', 'count'):
+        return f'{column} = coalesce({column}, 0) + coalesce(excluded.{column}, 0)'
+    return f'{column} = coalesce({agg}({column}, excluded.{column}), {column}, excluded.{column})'
+
+ROLLUP_UPSERT_SQL = f'''
+    INSERT INTO {{table}} (host_id, bucket, {', '.join(ROLLUP_COLUMNS)})
+    VALUES (?, ?, {', '.join('?' for _ in ROLLUP_COLUMNS)})
+    ON CONFLICT (host_id, bucket) DO UPDATE SET
+    {', '.join(_rollup_merge(f'{field}_{agg}', agg) for field in ROLLUP_FIELDS for agg in ROLLUP_AGGS)}
+'''
+
+def aggregate_rollups(items):
+    """先在内存中把一批样本按 (主机, 分辨率, 桶) 聚合，再逐桶 upsert
+
+    按样本自身的采集时间分桶，迟到的数据只会更新它所属的桶。
+    """
+    buckets = {}
+    for host_id, metrics, _ in items:
+        sample_time = sample_time_ms(metrics, time.time()) // 1000
+        for resolution in ROLLUP_RESOLUTIONS:
+            key = (host_id, resolution, sample_time - sample_time % resolution)
+            stats = buckets.setdefault(key, {field: [None, None, 0.0, 0] for field in ROLLUP_FIELDS})
+            for field in ROLLUP_FIELDS:
+                value = metrics.get(field)
+                if value is None:
+                    continue
+                agg = stats[field]
+                agg[0] = value if agg[0] is None else min(agg[0], value)
+                agg[1] = value if agg[1] is None else max(agg[1], value)
+                agg[2] += value
+                agg[3] += 1
+
+    rows = []
+    for key, stats in buckets.items():
+        row = list(key)
+        for field in ROLLUP_FIELDS:
+            row.extend(stats[field])
+        rows.append(tuple(row))
+    return rows
+
+def choose_resolution(start, end, points):
+    """选择仍能提供至少 points 个数据点的最粗分辨率，都不满足时返回 None（使用原始数据）"""
+    span = end - start
+    for resolution in sorted(ROLLUP_RESOLUTIONS, reverse=True):
+        if span / resolution >= points:
+            return resolution
+    return None
+
+def query_rollup_history(host_id, resolution, start, end, fields=ROLLUP_FIELDS, limit=HISTORY_DEFAULT_LIMIT, after=None):
+    """查询汇总数据，after 为上一页最后一个桶；返回 (数据点列表, 下一页游标或 None)"""
+    conditions = ['host_id = ?', 'bucket >= ?', 'bucket <= ?']
+    start = int(start) - int(start) % resolution
+    params = [host_id, start, int(end)]
+    if after is not None:
+        conditions.append('bucket > ?')
+        params.append(after)
+        start = max(start, after)
+
+    columns = ', '.join(f'{field}_{agg}' for field in fields for agg in ROLLUP_AGGS)
+    sql = f'''
+        SELECT bucket, {columns}
+        FROM {{table}}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY bucket
+        LIMIT ?
+    '''
+
+    rows = []
+    with get_db() as conn:
+        for _, table in rollup_partitions[resolution].overlapping(conn, start, end):
+            rows.extend(conn.execute(sql.format(table=table), params + [limit + 1 - len(rows)]).fetchall())
+            if len(rows) > limit:
+                break
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['bucket'])
+
+    points = []
+    for row in rows:
+        point = {'timestamp': row['bucket']}
+        for field in fields:
+            count = row[f'{field}_count'] or 0
+            point[field] = {
+                'min': row[f'{field}_min'],
+                'max': row[f'{field}_max'],
+                'avg': round(row[f'{field}_sum'] / count, 2) if count else None,
+                'count': int(count)
+            }
+        points.append(point)
+    return points, next_cursor
+
+# === 批量写入 ===
+WRITE_BATCH_SIZE = int(os.environ.get('WRITE_BATCH_SIZE', 5000))          # 单个事务最多写入的样本数
+WRITE_FLUSH_INTERVAL = float(os.environ.get('WRITE_FLUSH_INTERVAL', 2))   # 最长攒批时间（秒）
+WRITE_QUEUE_SIZE = int(os.environ.get('WRITE_QUEUE_SIZE', 50000))         # 待写入队列上限
+WRITE_QUEUE_TIMEOUT = float(os.environ.get('WRITE_QUEUE_TIMEOUT', 5))     # 队列满时写入方最长等待时间（秒）
+WRITE_RETRIES = 3
+
+class MetricsWriter:
+    """延迟批量写入：样本先进入队列，后台线程按数量或时间攒批后用一个事务提交
+
+    队列满时 submit 会阻塞写入方（最长 WRITE_QUEUE_TIMEOUT 秒）形成背压，仍然写不进去才丢弃；
+    进程退出时 close() 会把队列中剩余的样本全部写入。
+    """
+
+    def __init__(self, flush=save_metrics_many, batch_size=WRITE_BATCH_SIZE,
+                 flush_interval=WRITE_FLUSH_INTERVAL, queue_size=WRITE_QUEUE_SIZE):
+        self._flush = flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.written = 0
+        self.dropped = 0
+
+    def _ensure_started(self):
+        # 首次写入时才启动后台线程，保证多进程模式 fork 采集进程时主进程中没有该线程
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+                    self._thread.start()
+
+    def submit(self, host_id, metrics, data_source="real"):
+        self._ensure_started()
+        try:
+            self._queue.put((host_id, metrics, data_source), timeout=WRITE_QUEUE_TIMEOUT)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            print(f"写入队列已满，丢弃主机 {host_id} 的样本 (累计丢弃 {self.dropped})")
+            return False
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            batch = []
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        for attempt in range(WRITE_RETRIES):
+            try:
+                self._flush(batch)
+                self.written += len(batch)
+                return
+            except sqlite3.OperationalError as e:
+                print(f"批量写入失败 ({attempt + 1}/{WRITE_RETRIES}): {str(e)}")
+                time.sleep(0.5 * (attempt + 1))
+            except Exception as e:
+                # 不是数据库繁忙而是数据本身的问题，逐条写入，只丢弃出错的样本
+                print(f"批量写入失败，逐条写入以隔离异常样本: {str(e)}")
+                self._write_each(batch)
+                return
+        self.dropped += len(batch)
+
+    def _write_each(self, batch):
+        for item in batch:
+            try:
+                self._flush([item])
+                self.written += 1
+            except Exception as e:
+                self.dropped += 1
+                print(f"丢弃主机 {item[0]} 的异常样本: {str(e)}")
+
+    def close(self, timeout=10):
+        """停止后台线程并写入队列中剩余的样本"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        remaining = []
+        while True:
+            try:
+                remaining.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for i in range(0, len(remaining), self.batch_size):
+            self._write(remaining[i:i + self.batch_size])
+        if remaining:
+            print(f"退出前写入剩余样本 {len(remaining)} 条")
+
+metrics_writer = MetricsWriter()
+atexit.register(metrics_writer.close)
+
+# === SSH连接池 ===
+SSH_IDLE_TIMEOUT = int(os.environ.get('SSH_IDLE_TIMEOUT', 300))      # 空闲连接回收时间（秒），不短于主机采集间隔的两倍
+SSH_KEEPALIVE = int(os.environ.get('SSH_KEEPALIVE', 15))             # keepalive 间隔（秒）
+SSH_COMMAND_TIMEOUT = int(os.environ.get('SSH_COMMAND_TIMEOUT', 10))  # 单条命令超时（秒）
+
+class SSHConnectionPool:
+    """按 (ip, port, username) 复用已认证的SSH连接，采集时只需新开通道"""
+
+    def __init__(self, idle_timeout=SSH_IDLE_TIMEOUT, keepalive=SSH_KEEPALIVE):
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self._connections = {}  # key -> {'client', 'password', 'last_used', 'idle_timeout'}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(host):
+        return (host['ip'], int(host.get('port') or 22), host['username'])
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _connect(self, host):
         print(f"尝试SSH连接: {host['ip']}:{host.get('port', 22)} 用户: {host['username']}")
-        
-        ssh.connect(
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(
             hostname=host['ip'],
             username=host['username'],
             password=host['password'],
@@ -175,32 +1459,105 @@ def collect_real_metrics(host):
             timeout=10,
             banner_timeout=15
         )
-        
-        metrics = {}
-        
-        # 采集CPU使用率
-        stdin, stdout, stderr = ssh.exec_command("top -bn1 | grep 'Cpu(s)'")
-        cpu_output = stdout.read().decode()
-        metrics['cpu_usage'] = parse_cpu_usage(cpu_output)
-        
-        # 采集内存使用率
-        stdin, stdout, stderr = ssh.exec_command("free -m")
-        memory_output = stdout.read().decode()
-        memory_data = parse_memory_usage(memory_output)
-        metrics.update(memory_data)
-        
-        # 采集磁盘使用率
-        stdin, stdout, stderr = ssh.exec_command("df -h / | tail -1")
-        disk_output = stdout.read().decode()
-        metrics['disk_usage'] = parse_disk_usage(disk_output)
-        
-        # 采集系统负载
-        stdin, stdout, stderr = ssh.exec_command("cat /proc/loadavg")
-        load_output = stdout.read().decode()
-        metrics['load_avg'] = parse_load_avg(load_output)
-        
+        client.get_transport().set_keepalive(self.keepalive)
+        return client
+
+    def _idle_timeout(self, host):
+        """采集间隔较长的主机在两次采集之间不回收连接，否则每次采集都要重新握手"""
+        interval = host.get('collect_interval') or COLLECT_INTERVAL
+        return max(self.idle_timeout, 2 * interval)
+
+    @staticmethod
+    def _is_healthy(entry, host):
+        """连接仍存活、已认证，且主机密码未被修改"""
+        transport = entry['client'].get_transport()
+        return (transport is not None and transport.is_active()
+                and transport.is_authenticated()
+                and entry['password'] == host['password'])
+
+    def acquire(self, host):
+        """获取可用连接，返回 (client, 是否为复用连接)"""
+        key = self._key(host)
+        with self._key_lock(key):
+            entry = self._connections.get(key)
+            if entry and self._is_healthy(entry, host):
+                entry['last_used'] = time.time()
+                entry['idle_timeout'] = self._idle_timeout(host)
+                return entry['client'], True
+            if entry:
+                self._close_entry(entry)
+            client = self._connect(host)
+            self._connections[key] = {
+                'client': client,
+                'password': host['password'],
+                'last_used': time.time(),
+                'idle_timeout': self._idle_timeout(host)
+            }
+            return client, False
+
+    def has_connection(self, host):
+        """是否已有存活的池化连接（无需新握手）"""
+        entry = self._connections.get(self._key(host))
+        return bool(entry) and self._is_healthy(entry, host)
+
+    def discard(self, host):
+        """关闭并移除某主机的连接"""
+        key = self._key(host)
+        with self._key_lock(key):
+            entry = self._connections.pop(key, None)
+        if entry:
+            self._close_entry(entry)
+
+    def exec_command(self, host, command, timeout=SSH_COMMAND_TIMEOUT):
+        """在池化连接上执行命令并返回标准输出；复用连接失效时自动重连一次"""
+        while True:
+            client, reused = self.acquire(host)
+            try:
+                stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
+                return stdout.read().decode()
+            except (paramiko.SSHException, EOFError, OSError):
+                self.discard(host)
+                if not reused:
+                    raise
+                print(f"SSH连接已失效，重新连接: {host['ip']}")
+
+    def evict_idle(self):
+        """回收空闲超时或已断开的连接"""
+        now = time.time()
+        with self._lock:
+            stale = [key for key, entry in self._connections.items()
+                     if now - entry['last_used'] > entry['idle_timeout']
+                     or not entry['client'].get_transport()
+                     or not entry['client'].get_transport().is_active()]
+            entries = [self._connections.pop(key) for key in stale]
+        for entry in entries:
+            self._close_entry(entry)
+        return len(entries)
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._connections.values())
+            self._connections.clear()
+        for entry in entries:
+            self._close_entry(entry)
+
+    @staticmethod
+    def _close_entry(entry):
+        try:
+            entry['client'].close()
+        except Exception:
+            pass
+
+ssh_pool = SSHConnectionPool()
+
+# === 真实SSH数据采集 ===
+def collect_real_metrics(host):
+    """通过SSH采集真实服务器监控数据"""
+    try:
+        output = ssh_pool.exec_command(host, COLLECT_SCRIPT)
+        counters = parse_proc_counters(output)
+        metrics = compute_host_rates(host['id'], counters)
         metrics['timestamp'] = time.time()
-        ssh.close()
         
         print(f"SSH采集成功: {host['ip']} - CPU: {metrics['cpu_usage']}%")
         return metrics
@@ -209,59 +1566,6 @@ def collect_real_metrics(host):
         print(f"SSH采集失败 {host['ip']}: {str(e)}")
         return None
 
-def parse_cpu_usage(cpu_output):
-    try:
-        match = re.search(r'(\d+\.\d+)\s+id', cpu_output)
-        if match:
-            idle = float(match.group(1))
-            return round(100 - idle, 2)
-    except:
-        pass
-    return round(random.uniform(5, 30), 2)  # 失败时返回随机值
-
-def parse_memory_usage(memory_output):
-    try:
-        lines = memory_output.strip().split('\n')
-        if len(lines) >= 2:
-            mem_line = lines[1].split()
-            if len(mem_line) >= 7:
-                total = int(mem_line[1])
-                used = int(mem_line[2])
-                usage = (used / total) * 100 if total > 0 else 0
-                return {
-                    'memory_usage': round(usage, 2),
-                    'memory_total': total,
-                    'memory_used': used
-                }
-    except:
-        pass
-    # 失败时返回随机值
-    memory_total = random.randint(4096, 32768)
-    memory_usage = random.uniform(20, 80)
-    return {
-        'memory_usage': round(memory_usage, 2),
-        'memory_total': memory_total,
-        'memory_used': round(memory_total * memory_usage / 100)
-    }
-
-def parse_disk_usage(disk_output):
-    try:
-        parts = disk_output.split()
-        if len(parts) >= 5:
-            usage_str = parts[4].replace('%', '')
-            return float(usage_str)
-    except:
-        pass
-    return round(random.uniform(10, 50), 2)  # 失败时返回随机值
-
-def parse_load_avg(load_output):
-    try:
-        loads = load_output.split()[:3]
-        return [round(float(x), 2) for x in loads]
-    except:
-        pass
-    return [round(random.uniform(0.1, 2.0), 2) for _ in range(3)]  # 失败时返回随机值
-
 # === 模拟数据生成 ===
 def generate_simulated_metrics(host_id):
     """为模拟主机生成监控数据"""
@@ -297,6 +1601,76 @@ def generate_simulated_metrics(host_id):
         'timestamp': time.time()
     }
 
+# === 熔断器 ===
+PROBE_TIMEOUT = float(os.environ.get('PROBE_TIMEOUT', 2))                          # TCP 预探测超时（秒）
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 3))    # 连续失败多少次后熔断
+BREAKER_BASE_BACKOFF = int(os.environ.get('BREAKER_BASE_BACKOFF', 30))             # 首次熔断时长（秒）
+BREAKER_MAX_BACKOFF = int(os.environ.get('BREAKER_MAX_BACKOFF', 600))              # 熔断时长上限（秒）
+
+class HostUnreachableError(Exception):
+    """主机不可达（熔断中或 TCP 探测失败）"""
+
+class HostCircuitBreaker:
+    """每台主机一个熔断器：closed -> open -> half_open -> closed
+
+    连续失败达到阈值后进入 open，在退避时间内直接跳过该主机；退避结束后进入
+    half_open 放行一次探测，成功则恢复 closed，失败则退避时间翻倍（有上限）。
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 base_backoff=BREAKER_BASE_BACKOFF, max_backoff=BREAKER_MAX_BACKOFF):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._states = {}  # host_id -> {'state', 'failures', 'opens', 'open_until'}
+        self._lock = threading.Lock()
+
+    def allow(self, host_id):
+        """是否允许本次采集，不允许时抛出 HostUnreachableError"""
+        now = time.time()
+        with self._lock:
+            state = self._states.get(host_id)
+            if not state or state['state'] == 'closed':
+                return
+            if state['state'] == 'open':
+                if now < state['open_until']:
+                    raise HostUnreachableError(f"主机不可达，{int(state['open_until'] - now)}秒后重试")
+                state['state'] = 'half_open'
+                return
+            raise HostUnreachableError('主机不可达，正在探测恢复')
+
+    def record_success(self, host_id):
+        with self._lock:
+            state = self._states.pop(host_id, None)
+        if state and state['state'] != 'closed':
+            print(f"主机 {host_id} 恢复，熔断器关闭")
+
+    def record_failure(self, host_id):
+        now = time.time()
+        with self._lock:
+            state = self._states.setdefault(host_id, {'state': 'closed', 'failures': 0, 'opens': 0, 'open_until': 0})
+            state['failures'] += 1
+            if state['state'] == 'half_open' or state['failures'] >= self.failure_threshold:
+                backoff = min(self.max_backoff, self.base_backoff * 2 ** state['opens'])
+                state['opens'] += 1
+                state['state'] = 'open'
+                state['open_until'] = now + backoff
+                print(f"主机 {host_id} 熔断 {backoff} 秒 (第 {state['opens']} 次)")
+
+    def forget(self, host_id):
+        with self._lock:
+            self._states.pop(host_id, None)
+
+host_breaker = HostCircuitBreaker()
+
+def probe_tcp(ip, port, timeout=PROBE_TIMEOUT):
+    """TCP 预探测，避免对不可达主机付出完整的SSH超时"""
+    try:
+        with socket.create_connection((ip, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
 # === 智能数据采集 ===
 def collect_host_metrics(host):
     """根据主机类型采集数据"""
@@ -307,87 +1681,1542 @@ def collect_host_metrics(host):
         print(f"采集模拟主机: {host['ip']}")
         return generate_simulated_metrics(host['id'])
     else:
-        # 真实主机：尝试SSH采集，失败时使用模拟数据
+        # 真实主机：经过熔断器和 TCP 预探测后SSH采集，失败时返回 None（标记离线）
         print(f"采集真实主机: {host['ip']}")
-        real_metrics = collect_real_metrics(host)
+        host_breaker.allow(host['id'])
+        try:
+            if not ssh_pool.has_connection(host) and not probe_tcp(host['ip'], int(host.get('port') or 22)):
+                raise HostUnreachableError('TCP 探测失败，主机不可达')
+            real_metrics = collect_real_metrics(host)
+        except Exception:
+            host_breaker.record_failure(host['id'])
+            raise
         if real_metrics:
+            host_breaker.record_success(host['id'])
             return real_metrics
+        host_breaker.record_failure(host['id'])
+        return None
+
+# === 实时数据快照 ===
+REALTIME_PUBLISH_INTERVAL = float(os.environ.get('REALTIME_PUBLISH_INTERVAL', 1))  # 实时快照最短发布间隔（秒）
+REALTIME_DELTA_HISTORY = int(os.environ.get('REALTIME_DELTA_HISTORY', 300))        # 保留变更记录的版本数，落后更多的客户端返回全量
+
+def dump_json_bytes(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+class RealtimeSnapshot:
+    """某一版本的实时数据：发布后不再修改，序列化结果与 ETag 随快照缓存"""
+
+    __slots__ = ('version', 'data', 'body', 'etag', 'deltas')
+
+    def __init__(self, version, data, body):
+        self.version = version
+        self.data = data
+        self.body = body
+        self.etag = str(version)
+        self.deltas = {}  # since -> 序列化后的增量，同一起点的客户端共享
+
+class RealtimeStore:
+    """各主机的实时数据
+
+    采集线程只修改内部字典并记录变更的主机；读取时若有变更且距上次发布超过
+    REALTIME_PUBLISH_INTERVAL，就复制一份发布为新版本并序列化一次。
+    同一版本被所有看板共享，请求再多也只在每个发布周期序列化一次。
+    每个版本变更过的主机 ID 记录在 _changelog 中，用于返回增量。
+    """
+
+    def __init__(self, publish_interval=REALTIME_PUBLISH_INTERVAL, history=REALTIME_DELTA_HISTORY):
+        self.publish_interval = publish_interval
+        self._entries = {}
+        self._changed = set()
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._published_at = 0
+        # (version, 该版本变更或删除的主机ID)，按版本递增
+        self._changelog = collections.deque(maxlen=history)
+        # 版本号从启动时的毫秒时间开始，重启前拿到的旧版本号一定早于变更记录，会得到全量
+        self._base_version = int(time.time() * 1000)
+        self._snapshot = None
+        self.changed = threading.Event()  # 有新变更时置位，唤醒实时推送线程
+
+    def update(self, host_id, entry):
+        with self._lock:
+            self._entries[host_id] = entry
+            self._changed.add(host_id)
+        self.changed.set()
+
+    def remove(self, host_id):
+        with self._lock:
+            if self._entries.pop(host_id, None) is not None:
+                self._changed.add(host_id)
+        self.changed.set()
+
+    def get(self, host_id):
+        return self._entries.get(host_id)
+
+    def snapshot(self):
+        """返回当前发布的快照，必要时先发布新版本"""
+        snapshot = self._snapshot
+        if snapshot is not None and (not self._changed or time.time() - self._published_at < self.publish_interval):
+            return snapshot
+        with self._publish_lock:
+            # 等锁期间其他请求可能已经发布过
+            if self._snapshot is not snapshot:
+                return self._snapshot
+            with self._lock:
+                data = dict(self._entries)
+                changed = frozenset(self._changed)
+                self._changed = set()
+            self._published_at = time.time()
+            version = snapshot.version + 1 if snapshot else self._base_version
+            if snapshot is not None:
+                self._changelog.append((version, changed))
+            self._snapshot = RealtimeSnapshot(version, data, dump_json_bytes(data))
+            return self._snapshot
+
+    def changes_since(self, since, snapshot):
+        """since 之后到 snapshot 为止变更或删除过的主机ID；变更记录不足以覆盖时返回 None"""
+        changelog = list(self._changelog)
+        # since 之后的每个版本都还在变更记录中才能拼出增量
+        oldest = changelog[0][0] - 1 if changelog else snapshot.version
+        if since > snapshot.version or since < oldest:
+            return None
+        changed = set()
+        for version, host_ids in changelog:
+            if since < version <= snapshot.version:
+                changed.update(host_ids)
+        return changed
+
+    def delta(self, since):
+        """返回 (快照, 序列化后的增量)：since 之后变更和删除的主机；过旧或未知的版本返回全量"""
+        snapshot = self.snapshot()
+        body = snapshot.deltas.get(since)
+        if body is not None:
+            return snapshot, body
+        changed = self.changes_since(since, snapshot)
+        if changed is None:
+            payload = {'version': snapshot.version, 'full': True, 'hosts': snapshot.data, 'removed': []}
         else:
-            print(f"真实主机采集失败，使用模拟数据: {host['ip']}")
-            return generate_simulated_metrics(host['id'])
+            payload = {
+                'version': snapshot.version,
+                'full': False,
+                'hosts': {host_id: snapshot.data[host_id] for host_id in changed if host_id in snapshot.data},
+                'removed': sorted(host_id for host_id in changed if host_id not in snapshot.data)
+            }
+        body = dump_json_bytes(payload)
+        if len(snapshot.deltas) < self._changelog.maxlen:
+            snapshot.deltas[since] = body
+        return snapshot, body
+
+realtime_store = RealtimeStore()
+
+# === 实时推送 ===
+STREAM_HEARTBEAT_INTERVAL = int(os.environ.get('STREAM_HEARTBEAT_INTERVAL', 15))  # 空闲时发送心跳的间隔（秒）
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', 32))                  # 每个订阅者最多积压的事件数，超过即断开
+STREAM_RETRY_MS = 3000                                                            # 断线后浏览器重连的等待时间
+
+def sse_event(event, data, event_id=None):
+    """编码一条 SSE 事件，data 为单行 bytes（紧凑 JSON 不含换行）"""
+    head = f'id: {event_id}\nevent: {event}\n' if event_id is not None else f'event: {event}\n'
+    return head.encode('utf-8') + b'data: ' + data + b'\n\n'
+
+class StreamSubscriber:
+    __slots__ = ('queue', 'closed')
+
+    def __init__(self, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.closed = False
+
+class StreamHub:
+    """SSE 广播：后台线程在实时数据发布新版本时编码一次增量事件，所有订阅者共享同一份 bytes
+
+    每个订阅者一个有界队列；队列满说明客户端读得太慢，直接断开，由浏览器重连后
+    通过 Last-Event-ID 拿增量（或全量）补齐，不让慢客户端拖住广播线程或占用内存。
+    """
+
+    def __init__(self, store, queue_size=STREAM_QUEUE_SIZE, heartbeat=STREAM_HEARTBEAT_INTERVAL):
+        self.store = store
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._version = None
+        self.dropped = 0
+
+    def _ensure_started(self):
+        # 首个订阅者到来时才启动广播线程，与 MetricsWriter 一样避免在 fork 采集进程前启动线程
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='stream-hub', daemon=True)
+                    self._thread.start()
+
+    def subscribe(self):
+        """登记订阅者；调用方随后取得的首个快照不早于广播线程的增量起点，不会漏掉变更"""
+        self._ensure_started()
+        subscriber = StreamSubscriber(self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._version is None:
+                self._version = self.store.snapshot().version
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def broadcast(self, frame, version=None):
+        """frame 为编码好的事件；version 为该增量对应的数据版本（心跳等为 None）"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.queue.put_nowait((version, frame))
+            except queue.Full:
+                self._drop(subscriber)
+
+    def _drop(self, subscriber):
+        self.unsubscribe(subscriber)
+        subscriber.closed = True
+        self.dropped += 1
+        # 清空积压并放入结束标记，让该连接的响应生成器立即退出
+        try:
+            while True:
+                subscriber.queue.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            subscriber.queue.put_nowait(None)
+        except queue.Full:
+            pass  # 并发的主机变更事件抢先入队，生成器取到后检查 closed 同样会退出
+
+    def hosts_changed(self):
+        """主机增删后通知看板重新加载主机列表"""
+        if self._subscribers:
+            self.broadcast(sse_event('hosts', dump_json_bytes({'time': time.time()})))
+
+    def _run(self):
+        while True:
+            try:
+                if not self.store.changed.wait(self.heartbeat):
+                    self.broadcast(b': heartbeat\n\n')
+                    continue
+                self.store.changed.clear()
+                # 等一个发布间隔，把这段时间的变更合并为一个版本
+                time.sleep(self.store.publish_interval)
+                with self._lock:
+                    if not self._subscribers:
+                        # 没有订阅者时不发布快照，下一个订阅者到来时重新确定增量起点
+                        self._version = None
+                        continue
+                    since = self._version
+                snapshot, body = self.store.delta(since)
+                if snapshot.version != since:
+                    self._version = snapshot.version
+                    self.broadcast(sse_event('metrics', body, snapshot.version), snapshot.version)
+                    self.broadcast(sse_event('stats', dashboard_state.stats_body()))
+            except Exception as e:
+                print(f"实时推送错误: {str(e)}")
+                time.sleep(1)
+
+    def stats(self):
+        return {'subscribers': len(self._subscribers), 'dropped': self.dropped}
+
+stream_hub = StreamHub(realtime_store)
+
+# === 监控大屏汇总 ===
+DASHBOARD_TOP_N = int(os.environ.get('DASHBOARD_TOP_N', 5))                 # 每项指标列出的负载最高主机数
+DASHBOARD_METRICS = ('cpu_usage', 'memory_usage', 'disk_usage')             # 统计平均值和负载排行的指标
+# 主机列表可按这些实时指标排序
+DASHBOARD_SORT_METRICS = DASHBOARD_METRICS + ('disk_read_bps', 'disk_write_bps', 'net_rx_bps', 'net_tx_bps') + LOAD_SERIES
+DASHBOARD_HOST_FIELDS = ('id', 'name', 'ip', 'port', 'username', 'host_type', 'collect_interval')
+
+def number_or_none(value):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) and value == value else None
+
+def metric_value(entry, field):
+    """实时数据中某项指标的数值，load1/5/15 取自 load_avg 列表"""
+    if field in LOAD_SERIES:
+        loads = entry.get('load_avg')
+        index = LOAD_SERIES.index(field)
+        return number_or_none(loads[index]) if isinstance(loads, (list, tuple)) and len(loads) > index else None
+    return number_or_none(entry.get(field))
+
+class DashboardState:
+    """监控大屏数据：主机列表与实时数据的连接结果和全体统计
+
+    主机列表取自 host_registry，其 generation 变化后才重建；实时数据每发布一个版本，
+    只按变更记录更新变化的主机，并从计数和累加和中减去旧值、加上新值，
+    不再为每个看板从头统计。
+
+    每项指标还维护一个按 (值, host_id) 排序的列表，变化的主机用二分查找移除旧值、
+    插入新值；排行榜和按指标排序的分页都直接从列表一端读取，耗时与主机总数无关。
+    """
+
+    def __init__(self, store, top_n=DASHBOARD_TOP_N):
+        self.store = store
+        self.top_n = top_n
+        self._lock = threading.Lock()
+        self._hosts_generation = None  # 已加载的 host_registry.generation
+        self._version = None
+        self._order = []        # 主机ID，顺序同 host_registry.all()
+        self._rows = {}         # host_id -> 主机字段 + metrics
+        self._contrib = {}      # host_id -> 该主机计入统计的值
+        self._ranked = {field: [] for field in DASHBOARD_SORT_METRICS}  # 在线主机的 (值, host_id)，升序
+        self._totals = {}
+        self._stats = None
+        self._stats_body = None
+        self._body = None
+        self.etag = None
+
+    @staticmethod
+    def contribution(row):
+        """(模拟, 在线的非模拟主机, 上报数据, *DASHBOARD_SORT_METRICS 各项的值)"""
+        entry = row['metrics'] or {}
+        online = entry.get('status') == 'online'
+        simulated = row['host_type'] == 'simulated'
+        values = tuple(metric_value(entry, field) if online else None for field in DASHBOARD_SORT_METRICS)
+        return (simulated, online and not simulated, online) + values
+
+    def _apply(self, host_id, sign):
+        contrib = self._contrib[host_id]
+        totals = self._totals
+        totals['simulated'] += sign * contrib[0]
+        totals['online'] += sign * contrib[1]
+        totals['reporting'] += sign * contrib[2]
+        for field, value in zip(DASHBOARD_METRICS, contrib[3:]):
+            if value is not None:
+                totals[f'{field}_sum'] += sign * value
+                totals[f'{field}_count'] += sign
+
+    def _rebuild(self, snapshot):
+        generation = host_registry.generation
+        if generation != self._hosts_generation:
+            self._hosts_generation = generation
+            hosts = host_registry.all()
+            self._order = [host['id'] for host in hosts]
+            self._rows = {host['id']: {field: host.get(field) for field in DASHBOARD_HOST_FIELDS} for host in hosts}
+        self._totals = dict.fromkeys(('simulated', 'online', 'reporting'), 0)
+        for field in DASHBOARD_METRICS:
+            self._totals[f'{field}_sum'] = 0
+            self._totals[f'{field}_count'] = 0
+        self._contrib = {}
+        for host_id, row in self._rows.items():
+            row['metrics'] = snapshot.data.get(host_id)
+            self._contrib[host_id] = self.contribution(row)
+            self._apply(host_id, 1)
+        for index, field in enumerate(DASHBOARD_SORT_METRICS, start=3):
+            self._ranked[field] = sorted((contrib[index], host_id) for host_id, contrib in self._contrib.items()
+                                         if contrib[index] is not None)
+
+    def _update(self, snapshot, changed):
+        for host_id in changed:
+            row = self._rows.get(host_id)
+            if row is None:
+                continue
+            self._apply(host_id, -1)
+            old = self._contrib[host_id]
+            row['metrics'] = snapshot.data.get(host_id)
+            self._contrib[host_id] = new = self.contribution(row)
+            self._apply(host_id, 1)
+            for index, field in enumerate(DASHBOARD_SORT_METRICS, start=3):
+                if old[index] == new[index]:
+                    continue
+                ranked = self._ranked[field]
+                if old[index] is not None:
+                    del ranked[bisect.bisect_left(ranked, (old[index], host_id))]
+                if new[index] is not None:
+                    bisect.insort(ranked, (new[index], host_id))
+
+    def _top(self, field):
+        ranked = self._ranked[field]
+        return [{'id': host_id, 'name': self._rows[host_id]['name'], 'value': value}
+                for value, host_id in reversed(ranked[-self.top_n:])] if self.top_n > 0 else []
+
+    def refresh(self):
+        """同步到实时数据的最新版本，返回统计"""
+        snapshot = self.store.snapshot()
+        with self._lock:
+            hosts_stale = host_registry.generation != self._hosts_generation
+            if not hosts_stale and snapshot.version == self._version:
+                return self._stats
+            changed = None
+            if not hosts_stale and self._version is not None:
+                changed = self.store.changes_since(self._version, snapshot)
+            if changed is None:
+                self._rebuild(snapshot)
+            else:
+                self._update(snapshot, changed)
+            self._version = snapshot.version
+
+            totals = self._totals
+            total = len(self._rows)
+            self._stats = {
+                'version': snapshot.version,
+                'total': total,
+                'online': totals['online'],
+                'offline': total - totals['simulated'] - totals['online'],
+                'simulated': totals['simulated'],
+                'reporting': totals['reporting'],
+                'averages': {
+                    field: round(totals[f'{field}_sum'] / totals[f'{field}_count'], 2)
+                    if totals[f'{field}_count'] else None
+                    for field in DASHBOARD_METRICS
+                },
+                'top': {field: self._top(field) for field in DASHBOARD_METRICS}
+            }
+            self._stats_body = None
+            self._body = None
+            self.etag = f'{self._hosts_generation}-{snapshot.version}'
+            return self._stats
+
+    def stats_body(self):
+        self.refresh()
+        with self._lock:
+            if self._stats_body is None:
+                self._stats_body = dump_json_bytes(self._stats)
+            return self._stats_body
+
+    def body(self):
+        """完整载荷（主机列表 + 实时数据 + 统计），每个版本只序列化一次"""
+        self.refresh()
+        with self._lock:
+            if self._body is None:
+                self._body = dump_json_bytes({
+                    'version': self._version,
+                    'hosts': [self._rows[host_id] for host_id in self._order],
+                    'stats': self._stats
+                })
+            return self._body, self.etag
+
+    def matches(self, row, host_type=None, status=None, name_prefix=None):
+        if host_type and row['host_type'] != host_type:
+            return False
+        if name_prefix and not (row['name'] or '').startswith(name_prefix):
+            return False
+        if status:
+            online = bool(row['metrics']) and row['metrics'].get('status') == 'online'
+            if online != (status == 'online'):
+                return False
+        return True
+
+    def _ordered_ids(self, sort, descending):
+        """按排序字段依次产出 host_id；指标排序时没有数值的主机排在最后"""
+        if sort in self._ranked:
+            ranked = self._ranked[sort]
+            for _, host_id in (reversed(ranked) if descending else ranked):
+                yield host_id
+            index = 3 + DASHBOARD_SORT_METRICS.index(sort)
+            for host_id in self._order:
+                if self._contrib[host_id][index] is None:
+                    yield host_id
+        elif sort in ('created_at', 'id'):
+            # AUTOINCREMENT 的 id 与创建时间同序
+            yield from (self._order if descending else reversed(self._order))
+        else:
+            yield from sorted(self._rows, key=lambda host_id: ((self._rows[host_id][sort] or ''), host_id),
+                              reverse=descending)
+
+    def page(self, sort='created_at', descending=True, offset=0, limit=50,
+             host_type=None, status=None, name_prefix=None):
+        """在内存中过滤、排序、分页，返回 (主机行, 总数)；主机行含 metrics"""
+        self.refresh()
+        with self._lock:
+            filtered = bool(host_type or status or name_prefix)
+            items = []
+            skipped = 0
+            total = len(self._rows) if not filtered else 0
+            for host_id in self._ordered_ids(sort, descending):
+                row = self._rows[host_id]
+                if filtered and not self.matches(row, host_type, status, name_prefix):
+                    continue
+                if filtered:
+                    total += 1
+                if skipped < offset:
+                    skipped += 1
+                elif len(items) < limit:
+                    items.append(dict(row))
+                elif not filtered:
+                    # 无过滤条件时总数已知，取满一页即可结束
+                    break
+            return items, total
+
+dashboard_state = DashboardState(realtime_store)
+
+# === 最近数据环形缓冲 ===
+RECENT_WINDOW_SIZE = int(os.environ.get('RECENT_WINDOW_SIZE', 60))          # 每台主机在内存中保留的最近样本数
+RECENT_FIELDS = ('cpu_usage', 'memory_usage', 'disk_usage',
+                 'disk_read_bps', 'disk_write_bps', 'net_rx_bps', 'net_tx_bps')
+NAN = float('nan')
+
+class RingBuffer:
+    """单台主机最近 size 个样本
+
+    时间戳和各指标按样本交错存放在一个预分配的 array('d') 中（NaN 表示缺失），
+    写入只覆盖数组中的槽位，不再分配内存。
+    """
+    __slots__ = ('size', 'stride', 'data', 'pos', 'count', 'lock')
+
+    def __init__(self, size):
+        self.size = size
+        self.stride = len(RECENT_FIELDS) + 1
+        self.data = array('d', bytes(8 * size * self.stride))
+        self.pos = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, timestamp, metrics):
+        with self.lock:
+            base = self.pos * self.stride
+            self.data[base] = timestamp
+            for offset, field in enumerate(RECENT_FIELDS, 1):
+                value = metrics.get(field)
+                try:
+                    self.data[base + offset] = NAN if value is None else value
+                except TypeError:
+                    self.data[base + offset] = NAN
+            self.pos = (self.pos + 1) % self.size
+            if self.count < self.size:
+                self.count += 1
+
+    def snapshot(self, since=None, fields=RECENT_FIELDS):
+        """按时间先后返回 {'timestamps': [...], 字段: [...]}，since 之前的样本不返回"""
+        offsets = [RECENT_FIELDS.index(field) + 1 for field in fields]
+        with self.lock:
+            start = (self.pos - self.count) % self.size
+            slots = [(start + i) % self.size * self.stride for i in range(self.count)]
+            rows = [self.data[base:base + self.stride] for base in slots]
+        if since is not None:
+            rows = [row for row in rows if row[0] >= since]
+        result = {'timestamps': [row[0] for row in rows]}
+        for field, offset in zip(fields, offsets):
+            result[field] = [None if row[offset] != row[offset] else row[offset] for row in rows]
+        return result
+
+    def nbytes(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.data) + sys.getsizeof(self.lock)
+
+class RecentStore:
+    """所有主机的环形缓冲，与 realtime_store 一起更新，查询不访问数据库"""
+
+    def __init__(self, size=RECENT_WINDOW_SIZE):
+        self.size = size
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def record(self, host_id, metrics):
+        buffer = self._buffers.get(host_id)
+        if buffer is None:
+            with self._lock:
+                buffer = self._buffers.setdefault(host_id, RingBuffer(self.size))
+        timestamp = metrics.get('timestamp')
+        buffer.append(timestamp if isinstance(timestamp, (int, float)) else time.time(), metrics)
+
+    def window(self, host_id, seconds=None, fields=RECENT_FIELDS):
+        buffer = self._buffers.get(host_id)
+        if buffer is None:
+            return None
+        return buffer.snapshot(time.time() - seconds if seconds else None, fields)
+
+    def host_ids(self):
+        return list(self._buffers)
+
+    def forget(self, host_id):
+        with self._lock:
+            self._buffers.pop(host_id, None)
+
+    def memory_usage(self):
+        buffers = list(self._buffers.values())
+        return {
+            'hosts': len(buffers),
+            'window_size': self.size,
+            'bytes': sys.getsizeof(self._buffers) + sum(buffer.nbytes() for buffer in buffers)
+        }
+
+recent_store = RecentStore()
 
 # === 调度器 ===
-def start_scheduler():
-    def collection_loop():
+COLLECT_INTERVAL = int(os.environ.get('COLLECT_INTERVAL', 30))                        # 默认采集间隔（秒）
+MIN_COLLECT_INTERVAL = 1                                                              # 单台主机允许的最小采集间隔
+COLLECT_WORKERS = int(os.environ.get('COLLECT_WORKERS', 32))                          # 并发采集线程数上限
+COLLECT_TIMEOUT = int(os.environ.get('COLLECT_TIMEOUT', 25))                          # 单次采集的截止时间（秒）
+SCHEDULER_REFRESH_INTERVAL = int(os.environ.get('SCHEDULER_REFRESH_INTERVAL', 10))    # 重新读取主机列表的间隔（秒）
+COLLECTOR_PROCESSES = int(os.environ.get('COLLECTOR_PROCESSES', 0))                  # 采集进程数，0 表示在 Flask 进程内采集
+
+collect_executor = ThreadPoolExecutor(max_workers=COLLECT_WORKERS, thread_name_prefix='collector')
+# 仍在采集中的主机 -> 开始时间（未返回的主机不会被重复提交）
+inflight_hosts = {}
+inflight_lock = threading.Lock()
+
+def store_host_metrics(host, metrics):
+    """保存采集结果并更新实时数据"""
+    data_source = 'simulated' if host.get('host_type') == 'simulated' else 'real'
+    metrics_writer.submit(host['id'], metrics, data_source)
+    recent_store.record(host['id'], metrics)
+    realtime_store.update(host['id'], {
+        **metrics,
+        'last_update': time.time(),
+        'status': 'online',
+        'data_source': data_source,
+        'host_type': host.get('host_type', 'real')
+    })
+    return data_source
+
+def apply_collect_result(host, metrics, error=None):
+    """写入采集结果：成功时保存并更新实时数据，失败时标记离线"""
+    if metrics:
+        data_source = store_host_metrics(host, metrics)
+        print(f"主机 {host['ip']} 采集成功 ({data_source}数据)")
+    else:
+        realtime_store.update(host['id'], {
+            'status': 'offline',
+            'error': error or '采集失败'
+        })
+        print(f"主机 {host['ip']} 采集失败: {error or '采集失败'}")
+
+# 采集结果处理函数；多进程模式下采集进程把它替换为写入结果队列，由主进程统一写入
+collect_result_handler = apply_collect_result
+
+def collect_single_host(host):
+    """采集单台主机（在采集线程池中执行）"""
+    try:
+        metrics = collect_host_metrics(host)
+        collect_result_handler(host, metrics)
+    except Exception as e:
+        print(f"采集主机 {host['ip']} 异常: {str(e)}")
+        collect_result_handler(host, None, str(e))
+    finally:
+        with inflight_lock:
+            inflight_hosts.pop(host['id'], None)
+
+class CollectionScheduler:
+    """基于优先队列的采集调度器
+
+    每台主机按自己的 collect_interval 独立调度，首次加入时随机分配相位以打散负载；
+    调度落后时跳过错过的时隙，按原相位继续，不会集中补采。
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self._heap = []          # (下次采集时间, host_id)
+        self._due = {}           # host_id -> 下次采集时间，与堆中不一致的条目视为已失效
+        self._hosts = {}         # host_id -> host
+        self._timed_out = set()  # 已标记为超时、仍未返回的主机
+        self._rng = random.Random()
+        self._wake = threading.Event()
+        self._refresh_requested = False
+        self.missed_slots = 0
+
+    @staticmethod
+    def host_interval(host):
+        return max(MIN_COLLECT_INTERVAL, host.get('collect_interval') or COLLECT_INTERVAL)
+
+    def request_refresh(self):
+        """主机增删或间隔变更后调用，立即重新加载主机列表"""
+        self._refresh_requested = True
+        self._wake.set()
+
+    def sync_hosts(self, hosts):
+        """同步主机列表：新主机随机相位入队，间隔变更的主机重新排期"""
+        self._refresh_requested = False
+        now = time.time()
+        hosts = {h['id']: h for h in hosts}
+        for host_id, host in hosts.items():
+            old = self._hosts.get(host_id)
+            interval = self.host_interval(host)
+            if old is None or self.host_interval(old) != interval:
+                due = now + self._rng.uniform(0, interval)
+                self._due[host_id] = due
+                heapq.heappush(self._heap, (due, host_id))
+        for host_id in set(self._hosts) - set(hosts):
+            self._due.pop(host_id, None)
+            host_breaker.forget(host_id)
+            with collector_state_lock:
+                collector_state.pop(host_id, None)
+        self._hosts = hosts
+
+    def _next_due(self, due, interval, now):
+        next_due = due + interval
+        if next_due <= now:
+            missed = int((now - next_due) // interval) + 1
+            self.missed_slots += missed
+            next_due += missed * interval
+        return next_due
+
+    def dispatch_due(self, now):
+        """提交所有到期主机，返回 (提交数, 因上次采集未返回而跳过的数量)"""
+        dispatched = skipped = 0
+        while self._heap and self._heap[0][0] <= now:
+            due, host_id = heapq.heappop(self._heap)
+            if self._due.get(host_id) != due:
+                continue
+            host = self._hosts[host_id]
+            next_due = self._next_due(due, self.host_interval(host), now)
+            self._due[host_id] = next_due
+            heapq.heappush(self._heap, (next_due, host_id))
+
+            with inflight_lock:
+                if host_id in inflight_hosts:
+                    skipped += 1
+                    continue
+                inflight_hosts[host_id] = now
+            self.executor.submit(collect_single_host, host)
+            dispatched += 1
+        return dispatched, skipped
+
+    def check_timeouts(self, now):
+        """超过 COLLECT_TIMEOUT 仍未返回的主机标记为离线，采集线程返回后会再覆盖"""
+        with inflight_lock:
+            running = dict(inflight_hosts)
+        self._timed_out &= set(running)
+        for host_id, started in running.items():
+            if now - started > COLLECT_TIMEOUT and host_id not in self._timed_out:
+                self._timed_out.add(host_id)
+                host = self._hosts.get(host_id)
+                if host:
+                    collect_result_handler(host, None, '采集超时')
+
+    def next_due(self):
+        return self._heap[0][0] if self._heap else None
+
+    def wait(self, timeout):
+        self._wake.wait(timeout)
+        self._wake.clear()
+
+    @property
+    def refresh_requested(self):
+        return self._refresh_requested
+
+collection_scheduler = CollectionScheduler(collect_executor)
+
+def run_collection_engine(scheduler, load_hosts):
+    """采集引擎主循环：定期同步主机列表，按到期时间提交采集任务"""
+    next_refresh = 0
+    while True:
+        try:
+            now = time.time()
+            if now >= next_refresh or scheduler.refresh_requested:
+                scheduler.sync_hosts(load_hosts())
+                evicted = ssh_pool.evict_idle()
+                if evicted:
+                    print(f"回收空闲SSH连接 {evicted} 个")
+                next_refresh = now + SCHEDULER_REFRESH_INTERVAL
+
+            dispatched, skipped = scheduler.dispatch_due(now)
+            if dispatched or skipped:
+                print(f"调度采集 {dispatched} 台主机，跳过 {skipped} 台 (累计错过时隙 {scheduler.missed_slots})")
+            scheduler.check_timeouts(now)
+
+            # 睡到下一台主机到期或下一次刷新，最长 1 秒以便检查超时
+            wake_at = min(next_refresh, now + 1)
+            next_due = scheduler.next_due()
+            if next_due is not None:
+                wake_at = min(wake_at, next_due)
+            scheduler.wait(max(0, wake_at - time.time()))
+        except Exception as e:
+            print(f"调度器错误: {str(e)}")
+            time.sleep(10)
+
+# === 多进程分片采集 ===
+class HashRing:
+    """一致性哈希环：按 host_id 把主机分配到采集进程，进程增减时只迁移少量主机"""
+
+    def __init__(self, nodes, replicas=64):
+        self.nodes = list(nodes)
+        self._ring = sorted((self._hash(f'{node}:{i}'), node) for node in self.nodes for i in range(replicas))
+        self._keys = [key for key, _ in self._ring]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def node_for(self, host_id):
+        if not self._ring:
+            return None
+        index = bisect.bisect(self._keys, self._hash(str(host_id))) % len(self._ring)
+        return self._ring[index][1]
+
+# shard_id -> {'process', 'control'}，仅在主进程中使用
+collector_shards = {}
+
+def shard_worker_main(shard_id, shard_ids, control_queue, result_queue):
+    """采集进程入口：只采集哈希到本分片的主机，结果经队列交给主进程写入"""
+    global collect_result_handler
+    collect_result_handler = lambda host, metrics, error=None: result_queue.put((host, metrics, error))
+
+    ring = {'current': HashRing(shard_ids)}
+    executor = ThreadPoolExecutor(max_workers=COLLECT_WORKERS, thread_name_prefix=f'collector-{shard_id}')
+    scheduler = CollectionScheduler(executor)
+
+    def control_loop():
+        while True:
+            message = control_queue.get()
+            # 主机表由主进程修改，本进程的缓存在收到通知后重新读库
+            host_registry.invalidate()
+            if message[0] == 'members':
+                ring['current'] = HashRing(message[1])
+                print(f"采集进程 {shard_id}: 分片成员变更为 {message[1]}")
+            scheduler.request_refresh()
+
+    def load_hosts():
+        return [h for h in get_all_hosts()
+                if h.get('host_type') != 'push' and ring['current'].node_for(h['id']) == shard_id]
+
+    threading.Thread(target=control_loop, daemon=True).start()
+    print(f"采集进程 {shard_id} 已启动 (pid {os.getpid()})")
+    run_collection_engine(scheduler, load_hosts)
+
+def notify_hosts_changed():
+    """主机增删或间隔变更后通知采集引擎重新分配"""
+    collection_scheduler.request_refresh()
+    for shard in list(collector_shards.values()):
+        shard['control'].put(('refresh',))
+    stream_hub.hosts_changed()
+
+def start_sharded_collectors(count):
+    """启动 count 个采集进程；必须在主进程启动任何线程之前调用（使用 fork）"""
+    ctx = multiprocessing.get_context('fork')
+    result_queue = ctx.Queue()
+    shard_ids = list(range(count))
+    for shard_id in shard_ids:
+        control_queue = ctx.Queue()
+        process = ctx.Process(target=shard_worker_main, name=f'collector-{shard_id}',
+                              args=(shard_id, shard_ids, control_queue, result_queue), daemon=True)
+        process.start()
+        collector_shards[shard_id] = {'process': process, 'control': control_queue}
+
+    def result_writer_loop():
+        # 唯一的写入者：所有采集进程的结果都在这里落库并更新实时数据
         while True:
             try:
-                hosts = get_all_hosts()
-                print(f"开始采集周期，共 {len(hosts)} 台主机")
-                
-                for host in hosts:
-                    try:
-                        metrics = collect_host_metrics(host)
-                        if metrics:
-                            # 确定数据来源
-                            data_source = 'simulated' if host.get('host_type') == 'simulated' else 'real'
-                            save_metrics(host['id'], metrics, data_source)
-                            
-                            realtime_metrics[host['id']] = {
-                                **metrics,
-                                'last_update': time.time(),
-                                'status': 'online',
-                                'data_source': data_source,
-                                'host_type': host.get('host_type', 'real')
-                            }
-                            print(f"主机 {host['ip']} 采集成功 ({data_source}数据)")
-                        else:
-                            realtime_metrics[host['id']] = {
-                                'status': 'offline',
-                                'error': '采集失败'
-                            }
-                            print(f"主机 {host['ip']} 采集失败")
-                    except Exception as e:
-                        print(f"采集主机 {host['ip']} 异常: {str(e)}")
-                        realtime_metrics[host['id']] = {
-                            'status': 'offline',
-                            'error': str(e)
-                        }
-                
-                print(f"采集周期完成，等待30秒")
-                time.sleep(30)
+                host, metrics, error = result_queue.get()
+                apply_collect_result(host, metrics, error)
             except Exception as e:
-                print(f"调度器错误: {str(e)}")
-                time.sleep(10)
-    
-    thread = threading.Thread(target=collection_loop, daemon=True)
+                print(f"写入采集结果失败: {str(e)}")
+
+    def supervisor_loop():
+        # 采集进程退出后从哈希环中移除，由其余进程接管它的主机
+        while True:
+            time.sleep(SCHEDULER_REFRESH_INTERVAL)
+            try:
+                dead = [shard_id for shard_id, shard in collector_shards.items() if not shard['process'].is_alive()]
+                for shard_id in dead:
+                    print(f"采集进程 {shard_id} 已退出，重新分配其主机")
+                    del collector_shards[shard_id]
+                if dead:
+                    for shard in list(collector_shards.values()):
+                        shard['control'].put(('members', sorted(collector_shards)))
+                mark_stale_push_hosts([h for h in get_all_hosts() if h.get('host_type') == 'push'])
+            except Exception as e:
+                print(f"采集进程监控错误: {str(e)}")
+
+    threading.Thread(target=result_writer_loop, daemon=True).start()
+    threading.Thread(target=supervisor_loop, daemon=True).start()
+    print(f"已启动 {count} 个采集进程")
+
+def start_scheduler():
+    # 采集进程用 fork 启动，维护线程必须在 fork 之后再启动，子进程才不会继承它持有的锁
+    if COLLECTOR_PROCESSES > 0:
+        start_sharded_collectors(COLLECTOR_PROCESSES)
+    threading.Thread(target=maintenance_loop, name='maintenance', daemon=True).start()
+    if COLLECTOR_PROCESSES > 0:
+        return
+
+    def load_hosts():
+        hosts = get_all_hosts()
+        mark_stale_push_hosts([h for h in hosts if h.get('host_type') == 'push'])
+        return [h for h in hosts if h.get('host_type') != 'push']
+
+    thread = threading.Thread(target=run_collection_engine, args=(collection_scheduler, load_hosts), daemon=True)
     thread.start()
 
+# === Agent推送接入 ===
+PUSH_STALE_TIMEOUT = int(os.environ.get('PUSH_STALE_TIMEOUT', 90))           # 超过该时间未推送视为离线（秒）
+INGEST_MAX_BYTES = int(os.environ.get('INGEST_MAX_BYTES', 16 * 1024 * 1024))  # 解压后请求体上限
+
+# Agent 可推送的指标字段，其余字段丢弃
+PUSH_METRIC_FIELDS = (
+    'cpu_usage', 'memory_usage', 'memory_total', 'memory_used', 'disk_usage', 'load_avg',
+    'disk_read_bps', 'disk_write_bps', 'net_rx_bps', 'net_tx_bps', 'timestamp'
+)
+
+def push_number(value):
+    """把推送的指标值转换为数值，None 原样返回，无法转换或不是有限数时抛出 ValueError"""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f'无效数值: {value!r}')
+    if isinstance(value, int):
+        return value
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'无效数值: {value!r}')
+    if not math.isfinite(number):
+        raise ValueError(f'无效数值: {value!r}')
+    return number
+
+def normalize_push_sample(sample):
+    """挑出 Agent 可推送的字段并把指标值转换为数值，任何字段无效时抛出 ValueError"""
+    metrics = {}
+    for key in PUSH_METRIC_FIELDS:
+        if key not in sample:
+            continue
+        value = sample[key]
+        if key == 'load_avg':
+            if value is None:
+                value = []
+            if not isinstance(value, (list, tuple)):
+                raise ValueError(f'load_avg 必须是数组: {value!r}')
+            try:
+                metrics[key] = [push_number(v) for v in value[:3]]
+            except ValueError as e:
+                raise ValueError(f'load_avg: {str(e)}')
+        else:
+            try:
+                metrics[key] = push_number(value)
+            except ValueError as e:
+                raise ValueError(f'{key}: {str(e)}')
+    if metrics.get('timestamp') is None:
+        metrics['timestamp'] = time.time()
+    return metrics
+
+def read_ingest_body():
+    """读取请求体，支持 gzip 压缩，并限制解压后的大小"""
+    raw = request.get_data()
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        raw = decompressor.decompress(raw, INGEST_MAX_BYTES)
+        if decompressor.unconsumed_tail:
+            raise ValueError('请求体过大')
+    elif len(raw) > INGEST_MAX_BYTES:
+        raise ValueError('请求体过大')
+    return json.loads(raw.decode('utf-8'))
+
+def push_token_matches(token, expected):
+    """常量时间比较 Agent 令牌；compare_digest 对含非 ASCII 字符的 str 会抛出 TypeError，统一按 UTF-8 字节比较"""
+    if token is None:
+        return False
+    return hmac.compare_digest(str(token).encode('utf-8'), str(expected).encode('utf-8'))
+
+def mark_stale_push_hosts(push_hosts):
+    """推送主机超时未上报时标记为离线"""
+    now = time.time()
+    for host in push_hosts:
+        current = realtime_store.get(host['id'])
+        if current and current.get('status') != 'online':
+            continue
+        if current and now - current.get('last_update', 0) <= PUSH_STALE_TIMEOUT:
+            continue
+        realtime_store.update(host['id'], {
+            'status': 'offline',
+            'error': 'Agent 未推送数据',
+            'host_type': 'push'
+        })
+
+@app.route('/api/ingest', methods=['POST'])
+def ingest():
+    """接收 Agent 推送的批量样本
+
+    请求体: {"hosts": [{"host_id": 1, "token": "...", "samples": [{...}, ...]}, ...]}
+    """
+    try:
+        payload = read_ingest_body()
+    except (ValueError, zlib.error, UnicodeDecodeError) as e:
+        return jsonify({'success': False, 'error': f'请求体无效: {str(e)}'}), 400
+
+    if not isinstance(payload, dict) or not isinstance(payload.get('hosts'), list):
+        return jsonify({'success': False, 'error': '缺少字段: hosts'}), 400
+
+    try:
+        rows = []
+        rejected = []
+        latest_samples = {}
+
+        for entry in payload['hosts']:
+            if not isinstance(entry, dict):
+                continue
+            host = host_registry.get(entry.get('host_id'))
+            if not host or host.get('host_type') != 'push' or not push_token_matches(entry.get('token'), host['password']):
+                rejected.append(entry.get('host_id'))
+                continue
+
+            for index, sample in enumerate(entry.get('samples') or []):
+                if not isinstance(sample, dict):
+                    continue
+                # 任何样本无效时整个请求返回 400，不写入任何数据
+                try:
+                    metrics = normalize_push_sample(sample)
+                except ValueError as e:
+                    return jsonify({
+                        'success': False,
+                        'error': f'主机 {host["id"]} 的第 {index + 1} 个样本无效: {str(e)}'
+                    }), 400
+                rows.append((host['id'], metrics, 'real'))
+                latest = latest_samples.get(host['id'])
+                if latest is None or metrics['timestamp'] >= latest['timestamp']:
+                    latest_samples[host['id']] = metrics
+
+        for row in rows:
+            metrics_writer.submit(*row)
+            recent_store.record(row[0], row[1])
+
+        now = time.time()
+        for host_id, metrics in latest_samples.items():
+            realtime_store.update(host_id, {
+                **metrics,
+                'last_update': now,
+                'status': 'online',
+                'data_source': 'real',
+                'host_type': 'push'
+            })
+
+        return jsonify({
+            'success': True,
+            'accepted': len(rows),
+            'hosts': len(latest_samples),
+            'rejected': rejected
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/agent', methods=['GET'])
+def download_agent():
+    """下载推送 Agent 脚本"""
+    return send_from_directory(os.path.dirname(os.path.abspath(__file__)), 'agent.py', as_attachment=True)
+
+# === 历史数据导出 ===
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 5000))          # 导出时每次从数据库读取的样本数
+EXPORT_COLUMNS = ('host_id', 'timestamp', 'cpu_usage', 'memory_usage', 'memory_total', 'memory_used',
+                  'disk_usage', 'load1', 'load5', 'load15', 'data_source')
+
+def iter_history_export(host_ids, start=None, end=None, batch_size=EXPORT_BATCH_SIZE):
+    """逐主机按游标分页读取历史数据，内存中只保留一页，产出扁平化的行（load_avg 拆成 load1/5/15）"""
+    for host_id in host_ids:
+        after = None
+        while True:
+            points, next_cursor = query_metrics_history(host_id, start, end, HISTORY_FIELDS, batch_size, after)
+            for point in points:
+                loads = point.pop('load_avg') or []
+                point.update({name: loads[i] if len(loads) > i else None for i, name in enumerate(LOAD_SERIES)})
+                point['host_id'] = host_id
+                yield point
+            if not next_cursor:
+                break
+            after = decode_cursor(next_cursor)
+
+def iter_batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def stream_ndjson(rows, batch_size=1000):
+    for batch in iter_batches(rows, batch_size):
+        yield ''.join(json.dumps({column: row.get(column) for column in EXPORT_COLUMNS}) + '\n' for row in batch)
+
+def stream_csv(rows, batch_size=1000):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in iter_batches(rows, batch_size):
+        writer.writerows([row.get(column) for column in EXPORT_COLUMNS] for row in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+EXPORT_FORMATS = {
+    'ndjson': (stream_ndjson, 'application/x-ndjson'),
+    'csv': (stream_csv, 'text/csv'),
+}
+
+# === 聚合统计 ===
+AGGREGATE_METRICS = ('cpu_usage', 'memory_usage', 'memory_total', 'memory_used', 'disk_usage', 'load1', 'load5', 'load15')
+AGGREGATE_GROUPS = ('none', 'host', 'host_type')
+AGGREGATE_BLOCK_SIZE = 100000                                                # 每次从数据库取出的行数
+WINDOW_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def parse_window(value):
+    """'90s' / '15m' / '1h' / '7d' 或秒数"""
+    if value[-1:] in WINDOW_UNITS:
+        return float(value[:-1]) * WINDOW_UNITS[value[-1]]
+    return float(value)
+
+def parse_stat(stat):
+    """返回 ('quantile', 0~1) 或 (统计名, None)"""
+    if stat == 'median':
+        return 'quantile', 0.5
+    if re.fullmatch(r'p\d+(\.\d+)?', stat) and 0 <= float(stat[1:]) <= 100:
+        return 'quantile', float(stat[1:]) / 100
+    if stat in ('mean', 'min', 'max', 'sum', 'count'):
+        return stat, None
+    raise ValueError(f'不支持的统计量: {stat}')
+
+def metric_sources(conn, metric, start_ms, end_ms):
+    """时间范围内某个指标所在的表: [(类型, 表名, 取值表达式, 时间下界, 时间上界), ...]"""
+    start, end = start_ms / 1000, end_ms / 1000
+    sources = [('raw', table, metric, start_ms, end_ms)
+               for _, table in raw_partitions.overlapping(conn, start, end)]
+    sources += [('legacy', table, LEGACY_RAW_EXPRESSIONS.get(metric, metric), to_db_timestamp(start), to_db_timestamp(end))
+                for _, table in legacy_partitions.overlapping(conn, start, end)]
+    sources += [('chunks', table, None, start_ms, end_ms)
+                for _, table in chunk_partitions.overlapping(conn, start, end)]
+    if table_exists(conn, LEGACY_METRICS_TABLE):
+        sources.append(('legacy', LEGACY_METRICS_TABLE, LEGACY_RAW_EXPRESSIONS.get(metric, metric),
+                        to_db_timestamp(start), to_db_timestamp(end)))
+    return sources
+
+def iter_chunk_values(conn, table, metric, start_ms, end_ms, host_ids=None):
+    """解码压缩分区中某个指标的数据块，按块产出 (host_id, [值, ...])"""
+    host_filter, host_params = sql_in_filter('host_id', host_ids)
+    cursor = conn.execute(f'''
+        SELECT host_id, start_ts, count, data FROM {table}
+        WHERE metric = ?
+          AND (CASE WHEN end_ts < {SECONDS_TIMESTAMP_LIMIT} THEN end_ts * 1000 ELSE end_ts END) >= ?
+          AND (CASE WHEN start_ts < {SECONDS_TIMESTAMP_LIMIT} THEN start_ts * 1000 ELSE start_ts END) <= ?
+          {host_filter}
+    ''', [metric, start_ms, end_ms, *host_params])
+    for row in cursor:
+        scale = 1000 if row['start_ts'] < SECONDS_TIMESTAMP_LIMIT else 1
+        values = [value for ts, value in decode_chunk(row['data'], row['count'])
+                  if value is not None and start_ms <= ts * scale <= end_ms]
+        if values:
+            yield row['host_id'], values
+
+def sql_in_filter(column, values):
+    if values is None:
+        return '', []
+    return f" AND {column} IN ({', '.join('?' for _ in values)})", list(values)
+
+def iter_metric_rows(metric, start_ms, end_ms, host_ids=None):
+    """逐行读取：按块产出 [(host_id, 值), ...]"""
+    host_filter, host_params = sql_in_filter('host_id', host_ids)
+    with get_db() as conn:
+        conn.execute('BEGIN')  # 一个读事务内读完所有来源，迁移中的行只计一次
+        for kind, table, expression, low, high in metric_sources(conn, metric, start_ms, end_ms):
+            if kind == 'chunks':
+                for host_id, values in iter_chunk_values(conn, table, metric, start_ms, end_ms, host_ids):
+                    yield [(host_id, value) for value in values]
+                continue
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(f'''
+                SELECT host_id, {expression} AS value FROM {table}
+                WHERE timestamp >= ? AND timestamp <= ? AND value IS NOT NULL{host_filter}
+            ''', [low, high, *host_params])
+            while True:
+                block = cursor.fetchmany(AGGREGATE_BLOCK_SIZE)
+                if not block:
+                    break
+                yield block
+
+def iter_metric_columns(metric, start_ms, end_ms, host_ids=None):
+    """按列块读取：产出形状为 (n, 2) 的 numpy 数组，两列分别是 host_id 和取值
+
+    每块直接从游标的元组展开到连续的 float64 缓冲区，不构造中间的 Python 列表。
+    """
+    for block in iter_metric_rows(metric, start_ms, end_ms, host_ids):
+        yield np.fromiter(itertools.chain.from_iterable(block), dtype=np.float64, count=2 * len(block)).reshape(-1, 2)
+
+def empty_stat(stat):
+    """空分组的统计值：count/sum 为 0，其余统计量（均值、极值、分位数）没有定义，返回 None"""
+    return 0 if stat in ('count', 'sum') else None
+
+def aggregate_vectorized(blocks, group_of, group_count, stat, q):
+    """NumPy 路径：列块拼接成数组后，分组和统计都在 numpy 中完成，不逐行进入 Python"""
+    arrays = list(blocks)
+    if not arrays:
+        return [empty_stat(stat)] * group_count, [0] * group_count
+    data = np.concatenate(arrays)
+    host_ids = data[:, 0].astype(np.int64)
+    # 已删除主机的 id 可能超出映射表范围
+    groups = np.where(host_ids < len(group_of), group_of[np.minimum(host_ids, len(group_of) - 1)], -1)
+    keep = groups >= 0
+    groups, values = groups[keep], data[keep, 1]
+    if not len(values):
+        return [empty_stat(stat)] * group_count, [0] * group_count
+
+    counts = np.bincount(groups, minlength=group_count)
+    if stat in ('sum', 'mean', 'count'):
+        sums = np.bincount(groups, weights=values, minlength=group_count)
+        result = {'sum': sums, 'count': counts, 'mean': sums / np.maximum(counts, 1)}[stat]
+    else:
+        if group_count > 1:
+            # 分组下标是小整数，稳定排序走基数排序（O(n)），排序后每组是一段连续区间
+            order = np.argsort(groups.astype(np.int16 if group_count < 32768 else np.int64), kind='stable')
+            values = values[order]
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        present = counts > 0
+        result = np.full(group_count, np.nan)
+        if stat in ('min', 'max'):
+            reduce = np.minimum if stat == 'min' else np.maximum
+            result[present] = reduce.reduceat(values, starts[present])
+        else:
+            # 每组用 np.quantile（内部是 O(n) 的 partition，线性插值），不需要整体排序
+            for group in np.flatnonzero(present):
+                result[group] = np.quantile(values[starts[group]:starts[group] + counts[group]], q)
+    if stat == 'count':
+        return [int(c) for c in counts], [int(c) for c in counts]
+    values = [float(v) if c else empty_stat(stat) for v, c in zip(result, counts)]
+    return values, [int(c) for c in counts]
+
+def host_group_lookup(host_group):
+    """host_id -> 分组下标的映射表（numpy 数组，-1 表示不参与统计）"""
+    group_of = np.full(max(host_group, default=0) + 1, -1, dtype=np.int64)
+    for host_id, group in host_group.items():
+        group_of[host_id] = group
+    return group_of
+
+def aggregate_rows(blocks, group_of, group_count, stat, q):
+    """逐行路径：未安装 numpy 时使用，也是性能对比的基准"""
+    grouped = [[] for _ in range(group_count)]
+    for block in blocks:
+        for host_id, value in block:
+            group = group_of.get(host_id, -1)
+            if group >= 0:
+                grouped[group].append(value)
+
+    results = []
+    for values in grouped:
+        if not values:
+            results.append(empty_stat(stat))
+        elif stat == 'count':
+            results.append(len(values))
+        elif stat == 'sum':
+            results.append(sum(values))
+        elif stat == 'mean':
+            results.append(sum(values) / len(values))
+        elif stat == 'min':
+            results.append(min(values))
+        elif stat == 'max':
+            results.append(max(values))
+        else:
+            values.sort()
+            position = q * (len(values) - 1)
+            low = int(position)
+            high = min(low + 1, len(values) - 1)
+            results.append(values[low] + (values[high] - values[low]) * (position - low))
+    return results, [len(values) for values in grouped]
+
+def aggregate_groups(hosts, group_by):
+    """返回 (分组名列表, host_id -> 分组下标)"""
+    def group_key(host):
+        if group_by == 'host':
+            return str(host['id'])
+        if group_by == 'host_type':
+            return host.get('host_type') or 'real'
+        return 'all'
+
+    labels = ['all'] if group_by == 'none' else list(dict.fromkeys(group_key(h) for h in sorted(hosts, key=lambda h: h['id'])))
+    index = {label: i for i, label in enumerate(labels)}
+    return labels, {h['id']: index[group_key(h)] for h in hosts}
+
+def aggregate_metric(metric, stat, group_by, start, end, host_ids=None, vectorized=None):
+    """按 group_by 分组统计 [start, end]（epoch 秒）内某个指标，返回 (分组结果列表, 计算方式)"""
+    kind, q = parse_stat(stat)
+    hosts = get_all_hosts()
+    if host_ids is not None:
+        wanted = set(host_ids)
+        hosts = [h for h in hosts if h['id'] in wanted]
+    labels, host_group = aggregate_groups(hosts, group_by)
+
+    # 不指定主机时不在 SQL 中过滤（主机数可能超过 SQLite 参数上限），由分组映射丢弃无关的行
+    start_ms, end_ms = int(start * 1000), int(end * 1000)
+    if vectorized is None:
+        vectorized = np is not None
+    if vectorized:
+        values, counts = aggregate_vectorized(iter_metric_columns(metric, start_ms, end_ms, host_ids),
+                                              host_group_lookup(host_group), len(labels), kind, q)
+    else:
+        values, counts = aggregate_rows(iter_metric_rows(metric, start_ms, end_ms, host_ids),
+                                        host_group, len(labels), kind, q)
+
+    host_counts = {}
+    for group in host_group.values():
+        host_counts[group] = host_counts.get(group, 0) + 1
+    groups = [{'group': label, 'value': round(value, 4) if value is not None else None,
+               'samples': counts[i], 'hosts': host_counts.get(i, 0)}
+              for i, (label, value) in enumerate(zip(labels, values))]
+    return groups, 'numpy' if vectorized else 'python'
+
+# === 批量添加主机 ===
+HOST_IMPORT_FIELDS = ('ip', 'username', 'password', 'port', 'name', 'host_type', 'collect_interval')
+HOST_IMPORT_ERRORS_SHOWN = 100                                               # 校验失败时最多返回的错误行数
+
+def read_host_import():
+    """读取导入请求：上传的 CSV 文件、text/csv 请求体，或 JSON 数组 / {"hosts": [...]}"""
+    upload = request.files.get('file')
+    if upload is not None:
+        return list(csv.DictReader(io.StringIO(upload.read().decode('utf-8-sig'))))
+    if request.mimetype == 'text/csv':
+        return list(csv.DictReader(io.StringIO(request.get_data(as_text=True))))
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get('hosts')
+    if not isinstance(payload, list):
+        raise ValueError('需要 CSV 文件或主机数组')
+    return payload
+
+def parse_optional_int(value):
+    if value is None or value == '':
+        return None
+    return int(value)
+
+def host_import_row(entry):
+    """校验一条导入记录，返回 HOST_IMPORT_FIELDS 顺序的元组"""
+    if not isinstance(entry, dict):
+        raise ValueError('记录必须是对象')
+    entry = {key.strip(): (value.strip() if isinstance(value, str) else value)
+             for key, value in entry.items() if key}
+    host_type = entry.get('host_type') or 'real'
+    if host_type not in ('real', 'push'):
+        raise ValueError(f'不支持的主机类型: {host_type}')
+    if host_type == 'push':
+        entry['username'] = entry.get('username') or 'agent'
+        entry['password'] = entry.get('password') or entry.get('token') or secrets.token_hex(16)
+    for field in ('ip', 'username', 'password'):
+        if not entry.get(field):
+            raise ValueError(f'缺少字段: {field}')
+    port = parse_optional_int(entry.get('port')) or 22
+    if not 0 < port < 65536:
+        raise ValueError(f'端口无效: {port}')
+    collect_interval = parse_optional_int(entry.get('collect_interval'))
+    if collect_interval is not None and collect_interval < MIN_COLLECT_INTERVAL:
+        raise ValueError(f'collect_interval 必须是不小于 {MIN_COLLECT_INTERVAL} 的整数')
+    return (str(entry['ip']), str(entry['username']), str(entry['password']), port,
+            str(entry.get('name') or ''), host_type, collect_interval)
+
+def seed_simulated_hosts(hosts):
+    """新建的模拟主机立即生成一条数据，一个事务写入，看板不必等第一轮采集"""
+    items = []
+    now = time.time()
+    for host in hosts:
+        metrics = generate_simulated_metrics(host['id'])
+        items.append((host['id'], metrics, 'simulated'))
+        recent_store.record(host['id'], metrics)
+        realtime_store.update(host['id'], {
+            **metrics,
+            'last_update': now,
+            'status': 'online',
+            'data_source': 'simulated',
+            'host_type': 'simulated'
+        })
+    save_metrics_many(items)
+
+@app.route('/api/hosts/import', methods=['POST'])
+def import_hosts():
+    """批量导入真实 / 推送主机，全部校验通过后一个事务写入
+
+    CSV 表头或 JSON 字段: ip, username, password, port, name, host_type, collect_interval；
+    与已有主机（或本批前面的记录）ip 和端口都相同的记录跳过。
+    """
+    try:
+        entries = read_host_import()
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'success': False, 'error': f'请求体无效: {str(e)}'}), 400
+    if len(entries) > BULK_HOSTS_MAX:
+        return jsonify({'success': False, 'error': f'单次最多导入 {BULK_HOSTS_MAX} 台主机'}), 400
+
+    rows = []
+    errors = []
+    for index, entry in enumerate(entries, start=1):
+        try:
+            rows.append(host_import_row(entry))
+        except (ValueError, TypeError) as e:
+            errors.append({'row': index, 'error': str(e)})
+    if errors:
+        return jsonify({'success': False, 'error': f'{len(errors)} 条记录无效，未导入任何主机',
+                        'errors': errors[:HOST_IMPORT_ERRORS_SHOWN]}), 400
+
+    try:
+        seen = set()
+        new_rows = []
+        skipped = []
+        for index, row in enumerate(rows, start=1):
+            key = (row[0], row[3])
+            if key in seen or any(h['port'] == row[3] for h in host_registry.by_ip(row[0])):
+                skipped.append(index)
+                continue
+            seen.add(key)
+            new_rows.append(row)
+
+        hosts = add_hosts_many(new_rows) if new_rows else []
+        if hosts:
+            notify_hosts_changed()
+        result = {
+            'success': True,
+            'message': f'已导入 {len(hosts)} 台主机',
+            'created': len(hosts),
+            'ids': [h['id'] for h in hosts],
+            'skipped': skipped
+        }
+        # 推送主机的令牌只在创建时返回一次
+        tokens = {h['id']: row[2] for h, row in zip(hosts, new_rows) if row[5] == 'push'}
+        if tokens:
+            result['tokens'] = tokens
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/add-simulated-hosts', methods=['POST'])
+def add_simulated_hosts_bulk():
+    """批量添加模拟主机: {"count": 100, "name_prefix": "模拟主机"}"""
+    data = request.json or {}
+    try:
+        count = int(data.get('count', 1))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'count 必须是整数'}), 400
+    if not 0 < count <= BULK_HOSTS_MAX:
+        return jsonify({'success': False, 'error': f'count 必须在 1 到 {BULK_HOSTS_MAX} 之间'}), 400
+    prefix = data.get('name_prefix') or f'模拟主机-{int(time.time())}'
+
+    try:
+        hosts = add_simulated_hosts([f'{prefix}-{i}' for i in range(1, count + 1)])
+        notify_hosts_changed()
+        seed_simulated_hosts(hosts)
+        return jsonify({
+            'success': True,
+            'message': f'已添加 {len(hosts)} 台模拟主机',
+            'created': len(hosts),
+            'ids': [h['id'] for h in hosts],
+            'first_ip': hosts[0]['ip'],
+            'last_ip': hosts[-1]['ip']
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 # === API路由 ===
+PAGE_PARAMS = ('page', 'limit', 'cursor', 'sort', 'order', 'status', 'host_type', 'name')
+PAGE_DEFAULT_LIMIT = 50
+
+def parse_page_params(args, sort_fields):
+    """解析分页参数，返回 dict；page 从 1 开始，cursor 为上一页返回的 next_cursor"""
+    sort = args.get('sort', 'created_at')
+    if sort not in sort_fields:
+        raise ValueError(f'sort 只支持 {"/".join(sort_fields)}')
+    order = args.get('order') or ('asc' if sort in ('name', 'ip') else 'desc')
+    if order not in ('asc', 'desc'):
+        raise ValueError('order 只支持 asc/desc')
+    status = args.get('status') or None
+    if status not in (None, 'online', 'offline'):
+        raise ValueError('status 只支持 online/offline')
+    limit = int(args.get('limit', PAGE_DEFAULT_LIMIT))
+    page = int(args.get('page', 1))
+    if not 0 < limit <= HOST_PAGE_MAX_LIMIT or page < 1:
+        raise ValueError(f'limit 必须在 1 到 {HOST_PAGE_MAX_LIMIT} 之间，page 从 1 开始')
+    return {
+        'sort': sort,
+        'descending': order == 'desc',
+        'limit': limit,
+        'page': page,
+        'cursor': decode_cursor(args['cursor']) if args.get('cursor') else None,
+        'status': status,
+        'host_type': args.get('host_type') or None,
+        'name_prefix': args.get('name') or None
+    }
+
+def uses_realtime_page(params):
+    return bool(params['status']) or params['sort'] in DASHBOARD_SORT_METRICS
+
+def cursor_position(params, realtime):
+    """取出游标中的位置：内存分页的游标为 [排序字段, 偏移量]，主机表分页为 [排序字段, 排序值, id]
+
+    游标必须来自同一排序字段、同一种分页方式，否则抛出 ValueError。
+    """
+    cursor = params['cursor']
+    if cursor is None:
+        return None
+    if not isinstance(cursor, list) or len(cursor) != (2 if realtime else 3) or cursor[0] != params['sort']:
+        raise ValueError('cursor 与当前的排序或过滤条件不匹配，请从第一页重新开始')
+    position = cursor[1:]
+    if not isinstance(position[-1], int) or isinstance(position[-1], bool) or (realtime and position[0] < 0):
+        raise ValueError('cursor 无效')
+    return position
+
+def realtime_page(params, after=None):
+    """按实时状态过滤或按指标排序时走内存索引；after 为 cursor_position() 取出的 [偏移量]"""
+    offset = after[0] if after else (params['page'] - 1) * params['limit']
+    items, total = dashboard_state.page(params['sort'], params['descending'], offset, params['limit'],
+                                        params['host_type'], params['status'], params['name_prefix'])
+    next_offset = offset + len(items)
+    return items, total, encode_cursor(params['sort'], next_offset) if next_offset < total else None
+
 @app.route('/api/hosts', methods=['GET'])
 def get_hosts():
-    return jsonify(get_all_hosts())
+    """主机列表；带分页参数时返回一页: ?page=&limit=&cursor=&sort=&order=&status=&host_type=&name=
+
+    sort 可以是主机字段（created_at/id/name/ip，走 hosts 表索引）或实时指标（cpu_usage、disk_read_bps、
+    net_rx_bps、load1 等，走内存排序索引）；status 按实时在线状态过滤；name 为名称前缀。
+    """
+    if not any(key in request.args for key in PAGE_PARAMS):
+        return jsonify(get_all_hosts())
+    try:
+        params = parse_page_params(request.args, HOST_SORT_FIELDS + DASHBOARD_SORT_METRICS)
+        realtime = uses_realtime_page(params)
+        after = cursor_position(params, realtime)
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'参数错误: {str(e)}'}), 400
+
+    try:
+        if realtime:
+            rows, total, next_cursor = realtime_page(params, after)
+            hosts = get_hosts_by_ids([row['id'] for row in rows])
+        else:
+            offset = 0 if after else (params['page'] - 1) * params['limit']
+            hosts, total, next_cursor = query_hosts_page(
+                params['host_type'], params['name_prefix'], params['sort'], params['descending'],
+                params['limit'], offset, after)
+        return jsonify({
+            'items': hosts,
+            'total': total,
+            'limit': params['limit'],
+            'next_cursor': next_cursor
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/hosts', methods=['POST'])
 def create_host():
     data = request.json
     print("添加主机:", data)
     
+    host_type = data.get('host_type', 'real')
+    if host_type == 'push':
+        # 推送主机无需SSH凭据，password 字段保存 Agent 令牌
+        data.setdefault('username', 'agent')
+        data.setdefault('password', data.get('token') or secrets.token_hex(16))
+    
     required_fields = ['ip', 'username', 'password']
     for field in required_fields:
         if field not in data:
             return jsonify({'error': f'缺少字段: {field}'}), 400
     
+    collect_interval = data.get('collect_interval')
+    if collect_interval is not None and (not isinstance(collect_interval, int) or collect_interval < MIN_COLLECT_INTERVAL):
+        return jsonify({'error': f'collect_interval 必须是不小于 {MIN_COLLECT_INTERVAL} 的整数'}), 400
+    
     try:
-        host_type = data.get('host_type', 'real')
         host_id = add_host(
             data['ip'],
             data['username'],
             data['password'],
             data.get('port', 22),
             data.get('name', ''),
-            host_type
+            host_type,
+            collect_interval
         )
-        return jsonify({'id': host_id, 'message': '主机添加成功'})
+        notify_hosts_changed()
+        result = {'id': host_id, 'message': '主机添加成功'}
+        if host_type == 'push':
+            result['token'] = data['password']
+        return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -395,22 +3224,270 @@ def create_host():
 def remove_host(host_id):
     try:
         delete_host(host_id)
-        if host_id in realtime_metrics:
-            del realtime_metrics[host_id]
+        realtime_store.remove(host_id)
+        recent_store.forget(host_id)
+        with collector_state_lock:
+            collector_state.pop(host_id, None)
+        host_breaker.forget(host_id)
+        notify_hosts_changed()
         return jsonify({'message': '主机删除成功'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/hosts/<int:host_id>/interval', methods=['PUT'])
+def update_host_interval(host_id):
+    """修改主机采集间隔，collect_interval 为 null 时恢复默认间隔"""
+    data = request.json or {}
+    collect_interval = data.get('collect_interval')
+    if collect_interval is not None and (not isinstance(collect_interval, int) or collect_interval < MIN_COLLECT_INTERVAL):
+        return jsonify({'error': f'collect_interval 必须是不小于 {MIN_COLLECT_INTERVAL} 的整数'}), 400
+    
+    try:
+        if not set_host_interval(host_id, collect_interval):
+            return jsonify({'error': '主机未找到'}), 404
+        notify_hosts_changed()
+        return jsonify({
+            'message': '采集间隔已更新',
+            'collect_interval': collect_interval or COLLECT_INTERVAL
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/metrics', methods=['GET'])
 def get_metrics():
-    return jsonify(realtime_metrics)
+    """实时数据：返回缓存的快照，带 If-None-Match 且版本未变时返回 304
+
+    ?since=<版本号> 只返回变化的主机；带分页参数（同 /api/hosts）时返回排序后的一页。
+    """
+    if any(key in request.args for key in PAGE_PARAMS):
+        # 分页: 每项为主机字段加 metrics，可按实时指标排序、按在线状态过滤
+        try:
+            params = parse_page_params(request.args, HOST_SORT_FIELDS + DASHBOARD_SORT_METRICS)
+            items, total, next_cursor = realtime_page(params, cursor_position(params, True))
+        except (ValueError, TypeError) as e:
+            return jsonify({'error': f'参数错误: {str(e)}'}), 400
+        return jsonify({
+            'items': items,
+            'total': total,
+            'limit': params['limit'],
+            'next_cursor': next_cursor
+        })
+
+    since = request.args.get('since')
+    if since is not None:
+        # 增量: {"version", "full", "hosts": {变更的主机}, "removed": [删除的主机ID]}
+        try:
+            snapshot, body = realtime_store.delta(int(since))
+        except ValueError:
+            return jsonify({'error': 'since 必须是整数版本号'}), 400
+        response = Response(body, mimetype='application/json')
+        response.headers['X-Metrics-Version'] = str(snapshot.version)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    snapshot = realtime_store.snapshot()
+    if request.if_none_match.contains(snapshot.etag):
+        response = Response(status=304)
+    else:
+        response = Response(snapshot.body, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    response.headers['X-Metrics-Version'] = str(snapshot.version)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/dashboard', methods=['GET'])
+def get_dashboard():
+    """监控大屏一次取全：主机列表连同实时数据，以及在线/离线计数、平均值和负载排行"""
+    try:
+        body, etag = dashboard_state.body()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/stream', methods=['GET'])
+def stream_metrics():
+    """SSE 实时推送：连接后先发送全量（或按 Last-Event-ID 发送增量），之后推送每个版本的增量
+
+    事件: metrics（数据同 /api/metrics?since=），stats（同 /api/dashboard 的 stats），
+    hosts（主机列表有变化）；空闲时发送心跳注释。
+    """
+    try:
+        since = int(request.headers.get('Last-Event-ID') or request.args.get('since') or 0)
+    except ValueError:
+        since = 0
+    subscriber = stream_hub.subscribe()
+    snapshot, body = realtime_store.delta(since)
+
+    def generate():
+        try:
+            yield f'retry: {STREAM_RETRY_MS}\n\n'.encode('utf-8')
+            yield sse_event('metrics', body, snapshot.version)
+            sent_version = snapshot.version
+            while True:
+                item = subscriber.queue.get()
+                if item is None or subscriber.closed:
+                    return
+                version, frame = item
+                if version is not None:
+                    # 订阅后、首个快照前广播的增量已包含在快照中
+                    if version <= sent_version:
+                        continue
+                    sent_version = version
+                yield frame
+        finally:
+            stream_hub.unsubscribe(subscriber)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 反向代理不要缓冲事件流
+    return response
+
+@app.route('/api/recent', methods=['GET'])
+def get_recent_metrics():
+    """最近数据（内存环形缓冲，不访问数据库）: ?host_ids=1,2&fields=cpu_usage,memory_usage&seconds=300"""
+    try:
+        host_ids = ([int(h) for h in request.args['host_ids'].split(',') if h.strip()]
+                    if request.args.get('host_ids') else recent_store.host_ids())
+        seconds = float(request.args['seconds']) if request.args.get('seconds') else None
+    except ValueError as e:
+        return jsonify({'error': f'参数错误: {str(e)}'}), 400
+
+    fields = RECENT_FIELDS
+    if request.args.get('fields'):
+        fields = tuple(f.strip() for f in request.args['fields'].split(',') if f.strip())
+        unknown = [f for f in fields if f not in RECENT_FIELDS]
+        if unknown or not fields:
+            return jsonify({'error': f'未知字段: {", ".join(unknown)}', 'allowed': list(RECENT_FIELDS)}), 400
+
+    hosts = {}
+    for host_id in host_ids:
+        window = recent_store.window(host_id, seconds, fields)
+        if window is not None:
+            hosts[host_id] = window
+    return jsonify({'window_size': recent_store.size, 'fields': list(fields), 'hosts': hosts})
+
+@app.route('/api/aggregate', methods=['GET'])
+def get_aggregate():
+    """聚合统计: ?metric=cpu_usage&stat=p95&group_by=host_type&window=1h（或 from/to）&host_ids=1,2"""
+    metric = request.args.get('metric', 'cpu_usage')
+    stat = request.args.get('stat', 'mean')
+    group_by = request.args.get('group_by', 'none')
+    if metric not in AGGREGATE_METRICS:
+        return jsonify({'error': f'未知指标: {metric}', 'allowed': list(AGGREGATE_METRICS)}), 400
+    if group_by not in AGGREGATE_GROUPS:
+        return jsonify({'error': f'group_by 只支持 {"/".join(AGGREGATE_GROUPS)}'}), 400
+    try:
+        parse_stat(stat)
+        end = parse_time_param(request.args['to']) if request.args.get('to') else time.time()
+        if request.args.get('from'):
+            start = parse_time_param(request.args['from'])
+        else:
+            start = end - parse_window(request.args.get('window', '1h'))
+        host_ids = ([int(h) for h in request.args['host_ids'].split(',') if h.strip()]
+                    if request.args.get('host_ids') else None)
+    except ValueError as e:
+        return jsonify({'error': f'参数错误: {str(e)}'}), 400
+
+    try:
+        started = time.time()
+        groups, engine = aggregate_metric(metric, stat, group_by, start, end, host_ids)
+        return jsonify({
+            'metric': metric,
+            'stat': stat,
+            'group_by': group_by,
+            'from': start,
+            'to': end,
+            'groups': groups,
+            'engine': engine,
+            'elapsed_ms': round((time.time() - started) * 1000, 1)
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/export', methods=['GET'])
+def export_metrics():
+    """流式导出原始历史数据: ?format=ndjson|csv&host_ids=1,2&from=&to=，内存占用与导出行数无关"""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'format 只支持 {"/".join(EXPORT_FORMATS)}'}), 400
+    try:
+        start = parse_time_param(request.args['from']) if request.args.get('from') else None
+        end = parse_time_param(request.args['to']) if request.args.get('to') else None
+        host_ids = ([int(h) for h in request.args['host_ids'].split(',') if h.strip()]
+                    if request.args.get('host_ids') else sorted(h['id'] for h in get_all_hosts()))
+    except ValueError as e:
+        return jsonify({'error': f'参数错误: {str(e)}'}), 400
+
+    stream, mimetype = EXPORT_FORMATS[export_format]
+    return Response(
+        stream_with_context(stream(iter_history_export(host_ids, start, end))),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=metrics.{export_format}'}
+    )
+
+@app.route('/api/hosts/<int:host_id>/metrics', methods=['GET'])
+def get_host_metrics_history(host_id):
+    """主机历史数据: ?from=&to=&fields=cpu_usage,memory_usage&limit=&cursor=
+
+    resolution=raw|60|300|3600 指定分辨率；或者传 points=N，自动选择能提供至少 N 个点的最粗分辨率。
+    """
+    try:
+        start = parse_time_param(request.args['from']) if request.args.get('from') else None
+        end = parse_time_param(request.args['to']) if request.args.get('to') else None
+        limit = min(int(request.args.get('limit', HISTORY_DEFAULT_LIMIT)), HISTORY_MAX_LIMIT)
+        if limit < 1:
+            raise ValueError('limit 必须大于 0')
+
+        resolution = request.args.get('resolution', 'raw')
+        if request.args.get('points'):
+            # 自动选择分辨率时默认查询最近24小时
+            end = end or time.time()
+            start = start or end - 86400
+            resolution = choose_resolution(start, end, int(request.args['points'])) or 'raw'
+        elif resolution != 'raw':
+            resolution = int(resolution)
+            if resolution not in ROLLUP_RESOLUTIONS:
+                raise ValueError(f'resolution 只支持 raw/{"/".join(map(str, ROLLUP_RESOLUTIONS))}')
+        after = history_cursor(decode_cursor(request.args['cursor']), resolution) if request.args.get('cursor') else None
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': f'参数错误: {str(e)}'}), 400
+
+    allowed = HISTORY_FIELDS if resolution == 'raw' else ROLLUP_FIELDS
+    fields = allowed
+    if request.args.get('fields'):
+        fields = tuple(f.strip() for f in request.args['fields'].split(',') if f.strip())
+        unknown = [f for f in fields if f not in allowed]
+        if unknown or not fields:
+            return jsonify({'error': f'未知字段: {", ".join(unknown)}', 'allowed': list(allowed)}), 400
+
+    try:
+        if resolution == 'raw':
+            points, next_cursor = query_metrics_history(host_id, start, end, fields, limit, after)
+        else:
+            points, next_cursor = query_rollup_history(
+                host_id, resolution, start or 0, end or time.time(), fields, limit,
+                after[0] if after else None)
+        return jsonify({
+            'host_id': host_id,
+            'resolution': resolution,
+            'fields': list(fields),
+            'points': points,
+            'next_cursor': next_cursor
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/test-connection/<int:host_id>', methods=['POST'])
 def test_connection(host_id):
     """测试主机连接"""
     try:
-        hosts = get_all_hosts()
-        host = next((h for h in hosts if h['id'] == host_id), None)
+        host = host_registry.get(host_id)
         if not host:
             return jsonify({'success': False, 'error': '主机未找到'})
         
@@ -423,11 +3500,21 @@ def test_connection(host_id):
                 'message': '模拟主机连接测试成功',
                 'host_type': 'simulated'
             })
+        elif host_type == 'push':
+            # 推送主机：根据最近一次推送时间判断
+            current = realtime_store.get(host_id) or {}
+            online = current.get('status') == 'online'
+            return jsonify({
+                'success': online,
+                'message': 'Agent 推送正常' if online else 'Agent 未推送数据',
+                'host_type': 'push'
+            })
         else:
             # 真实主机：测试SSH连接
             print(f"测试SSH连接: {host['ip']}")
             real_metrics = collect_real_metrics(host)
             if real_metrics:
+                host_breaker.record_success(host_id)
                 return jsonify({
                     'success': True,
                     'message': 'SSH连接成功',
@@ -447,23 +3534,15 @@ def test_connection(host_id):
 def collect_now(host_id):
     """立即采集主机数据"""
     try:
-        hosts = get_all_hosts()
-        host = next((h for h in hosts if h['id'] == host_id), None)
+        host = host_registry.get(host_id)
         if not host:
             return jsonify({'success': False, 'error': '主机未找到'})
+        if host.get('host_type') == 'push':
+            return jsonify({'success': False, 'error': '推送主机由 Agent 上报数据，不支持立即采集'})
         
         metrics = collect_host_metrics(host)
         if metrics:
-            data_source = 'simulated' if host.get('host_type') == 'simulated' else 'real'
-            save_metrics(host_id, metrics, data_source)
-            
-            realtime_metrics[host_id] = {
-                **metrics,
-                'last_update': time.time(),
-                'status': 'online',
-                'data_source': data_source,
-                'host_type': host.get('host_type', 'real')
-            }
+            data_source = store_host_metrics(host, metrics)
             
             return jsonify({
                 'success': True,
@@ -479,41 +3558,22 @@ def collect_now(host_id):
 @app.route('/api/add-simulated-host', methods=['POST'])
 def add_simulated_host():
     """添加模拟主机"""
-    data = request.json
+    data = request.json or {}
     name = data.get('name', f'模拟主机-{int(time.time())}')
     
-    # 生成唯一的模拟IP
-    existing_hosts = get_all_hosts()
-    simulated_count = len([h for h in existing_hosts if h.get('host_type') == 'simulated'])
-    simulated_ip = f"127.0.0.{100 + simulated_count}"
-    
     try:
-        host_id = add_host(
-            ip=simulated_ip,
-            username='simulated',
-            password='simulated',
-            port=22,
-            name=name,
-            host_type='simulated'
-        )
+        host = add_simulated_hosts([name])[0]
+        notify_hosts_changed()
         
         # 立即生成初始数据
-        metrics = generate_simulated_metrics(host_id)
-        save_metrics(host_id, metrics, 'simulated')
-        realtime_metrics[host_id] = {
-            **metrics,
-            'last_update': time.time(),
-            'status': 'online',
-            'data_source': 'simulated',
-            'host_type': 'simulated'
-        }
+        seed_simulated_hosts([host])
         
         return jsonify({
             'success': True,
             'message': '模拟主机添加成功',
             'host': {
-                'id': host_id,
-                'ip': simulated_ip,
+                'id': host['id'],
+                'ip': host['ip'],
                 'name': name,
                 'host_type': 'simulated'
             }
@@ -524,15 +3584,18 @@ def add_simulated_host():
 @app.route('/health')
 def health_check():
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('SELECT 1')
-        return jsonify({'status': 'healthy', 'database': 'connected'})
+        with get_db() as conn:
+            conn.execute('SELECT 1')
+        return jsonify({'status': 'healthy', 'database': 'connected', 'recent_buffers': recent_store.memory_usage(), 'stream': stream_hub.stats(),
+                        'hosts': {'count': len(get_all_hosts()), 'generation': host_registry.generation}})
     except Exception as e:
         return jsonify({'status': 'unhealthy', 'error': str(e)}), 500
 
-# 启动定时任务
-start_scheduler()
+# 启动定时任务（离线工具导入本模块时设置 START_SCHEDULER=0）
+if os.environ.get('START_SCHEDULER', '1') == '1':
+    start_scheduler()
 
 if __name__ == '__main__':
+    # docker stop 发送 SIGTERM，转换为正常退出以便 atexit 写入剩余样本
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     app.run(host='0.0.0.0', port=5000, debug=False)
@@ -7,6 +7,9 @@ import time
 import random
 import json
 
+# /proc 计数器的采集脚本、解析和速率计算与服务端共用 proc_counters.py
+from proc_counters import COLLECT_SCRIPT, parse_proc_counters, compute_host_rates
+
 def collect_real_metrics(host):
     """通过SSH采集真实服务器监控数据"""
     try:
@@ -24,31 +27,13 @@ def collect_real_metrics(host):
             banner_timeout=15
         )
         
-        metrics = {}
-        
-        # 采集CPU使用率
-        stdin, stdout, stderr = ssh.exec_command("top -bn1 | grep 'Cpu(s)'")
-        cpu_output = stdout.read().decode()
-        metrics['cpu_usage'] = parse_cpu_usage(cpu_output)
-        
-        # 采集内存使用率
-        stdin, stdout, stderr = ssh.exec_command("free -m")
-        memory_output = stdout.read().decode()
-        memory_data = parse_memory_usage(memory_output)
-        metrics.update(memory_data)
-        
-        # 采集磁盘使用率
-        stdin, stdout, stderr = ssh.exec_command("df -h / | tail -1")
-        disk_output = stdout.read().decode()
-        metrics['disk_usage'] = parse_disk_usage(disk_output)
-        
-        # 采集系统负载
-        stdin, stdout, stderr = ssh.exec_command("cat /proc/loadavg")
-        load_output = stdout.read().decode()
-        metrics['load_avg'] = parse_load_avg(load_output)
+        stdin, stdout, stderr = ssh.exec_command(COLLECT_SCRIPT)
+        output = stdout.read().decode()
+        ssh.close()
         
+        counters = parse_proc_counters(output)
+        metrics = compute_host_rates(host['id'], counters)
         metrics['timestamp'] = time.time()
-        ssh.close()
         
         print(f"SSH采集成功: {host['ip']} - CPU: {metrics['cpu_usage']}%")
         return metrics
@@ -57,59 +42,6 @@ def collect_real_metrics(host):
         print(f"SSH采集失败 {host['ip']}: {str(e)}")
         return None
 
-def parse_cpu_usage(cpu_output):
-    try:
-        match = re.search(r'(\d+\.\d+)\s+id', cpu_output)
-        if match:
-            idle = float(match.group(1))
-            return round(100 - idle, 2)
-    except:
-        pass
-    return round(random.uniform(5, 30), 2)  # 失败时返回随机值
-
-def parse_memory_usage(memory_output):
-    try:
-        lines = memory_output.strip().split('\n')
-        if len(lines) >= 2:
-            mem_line = lines[1].split()
-            if len(mem_line) >= 7:
-                total = int(mem_line[1])
-                used = int(mem_line[2])
-                usage = (used / total) * 100 if total > 0 else 0
-                return {
-                    'memory_usage': round(usage, 2),
-                    'memory_total': total,
-                    'memory_used': used
-                }
-    except:
-        pass
-    # 失败时返回随机值
-    memory_total = random.randint(4096, 32768)
-    memory_usage = random.uniform(20, 80)
-    return {
-        'memory_usage': round(memory_usage, 2),
-        'memory_total': memory_total,
-        'memory_used': round(memory_total * memory_usage / 100)
-    }
-
-def parse_disk_usage(disk_output):
-    try:
-        parts = disk_output.split()
-        if len(parts) >= 5:
-            usage_str = parts[4].replace('%', '')
-            return float(usage_str)
-    except:
-        pass
-    return round(random.uniform(10, 50), 2)  # 失败时返回随机值
-
-def parse_load_avg(load_output):
-    try:
-        loads = load_output.split()[:3]
-        return [round(float(x), 2) for x in loads]
-    except:
-        pass
-    return [round(random.uniform(0.1, 2.0), 2) for _ in range(3)]  # 失败时返回随机值
-
 def generate_simulated_metrics(host_id):
     """为模拟主机生成监控数据"""
     # 使用host_id作为种子，确保同一主机数据稳定
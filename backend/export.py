@@ -0,0 +1,87 @@
+"""离线导出历史数据为 Parquet / Arrow 文件
+
+直接读取监控数据库（不需要服务在运行），按主机逐页读取，每攒满 --batch-size
+行写出一个 row group / record batch，内存占用与导出总行数无关。
+
+依赖 pyarrow（不在服务镜像的依赖中）:
+    pip install pyarrow
+
+用法:
+    python3 export.py --db /app/data/monitor.db --out metrics.parquet --from 2024-01-01 --to 2024-02-01
+    python3 export.py --format arrow --host-ids 1,2,3 --out metrics.arrow
+"""
+import argparse
+import os
+import sys
+
+def build_schema(pa):
+    return pa.schema([
+        ('host_id', pa.int64()),
+        ('timestamp', pa.timestamp('ms', tz='UTC')),
+        ('cpu_usage', pa.float64()),
+        ('memory_usage', pa.float64()),
+        ('memory_total', pa.float64()),
+        ('memory_used', pa.float64()),
+        ('disk_usage', pa.float64()),
+        ('load1', pa.float64()),
+        ('load5', pa.float64()),
+        ('load15', pa.float64()),
+        ('data_source', pa.string()),
+    ])
+
+def to_table(pa, schema, rows):
+    columns = {name: [row.get(name) for row in rows] for name in schema.names}
+    columns['timestamp'] = [round(ts * 1000) for ts in columns['timestamp']]
+    return pa.Table.from_pydict(columns, schema=schema)
+
+def main():
+    parser = argparse.ArgumentParser(description='导出监控历史数据为 Parquet / Arrow 文件')
+    parser.add_argument('--db', default=os.environ.get('DATABASE_PATH', '/app/data/monitor.db'))
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--format', choices=('parquet', 'arrow'), default='parquet')
+    parser.add_argument('--from', dest='start', help='起始时间，epoch 秒或 ISO 8601')
+    parser.add_argument('--to', dest='end', help='结束时间，epoch 秒或 ISO 8601')
+    parser.add_argument('--host-ids', help='逗号分隔的主机ID，默认导出全部主机')
+    parser.add_argument('--batch-size', type=int, default=100000, help='每个 row group 的行数')
+    args = parser.parse_args()
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print('需要安装 pyarrow: pip install pyarrow')
+        sys.exit(1)
+
+    if not os.path.exists(args.db):
+        print(f'数据库不存在: {args.db}')
+        sys.exit(1)
+
+    # 复用服务端的分区查询和数据块解码，但不启动采集调度；只读打开，不执行建表和迁移
+    os.environ['DATABASE_PATH'] = args.db
+    os.environ['DATABASE_READONLY'] = '1'
+    os.environ['START_SCHEDULER'] = '0'
+    import app
+
+    start = app.parse_time_param(args.start) if args.start else None
+    end = app.parse_time_param(args.end) if args.end else None
+    host_ids = ([int(h) for h in args.host_ids.split(',') if h.strip()]
+                if args.host_ids else sorted(h['id'] for h in app.get_all_hosts()))
+
+    schema = build_schema(pa)
+    if args.format == 'parquet':
+        writer = pq.ParquetWriter(args.out, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_file(args.out, schema)
+
+    total = 0
+    try:
+        for rows in app.iter_batches(app.iter_history_export(host_ids, start, end), args.batch_size):
+            writer.write_table(to_table(pa, schema, rows))
+            total += len(rows)
+            print(f"已导出 {total} 行")
+    finally:
+        writer.close()
+    print(f"导出完成: {args.out} ({total} 行, {len(host_ids)} 台主机)")
+
+if __name__ == '__main__':
+    main()
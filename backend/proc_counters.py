@@ -0,0 +1,143 @@
+"""/proc 计数器采集与速率计算
+
+服务端采集（app.py）和 datacollection.py 中的采集模块共用这一份实现：
+远程执行 COLLECT_SCRIPT，parse_proc_counters 解析输出，compute_host_rates
+与同一主机上一次的计数器做差得到各项速率。
+"""
+import re
+import threading
+
+# 所有指标在同一个通道内一次性采集，输出按分段标记拆分。
+# 只读取 /proc 原始计数器（read 为 shell 内建命令，不在目标主机上派生进程），
+# 速率由服务端根据相邻两次采样的差值计算。磁盘占用率没有 /proc 来源，仍使用 df。
+COLLECT_SECTION_MARK = '@@monitor:'
+COLLECT_SCRIPT = '; '.join([
+    'export LC_ALL=C',
+    "r() { while IFS= read -r l || [ -n \"$l\" ]; do printf '%s\\n' \"$l\"; done < \"$1\"; }",
+    f"echo '{COLLECT_SECTION_MARK}uptime'", 'r /proc/uptime',
+    f"echo '{COLLECT_SECTION_MARK}stat'", 'read -r l < /proc/stat', "printf '%s\\n' \"$l\"",
+    f"echo '{COLLECT_SECTION_MARK}meminfo'", 'r /proc/meminfo',
+    f"echo '{COLLECT_SECTION_MARK}loadavg'", 'r /proc/loadavg',
+    f"echo '{COLLECT_SECTION_MARK}diskstats'", 'r /proc/diskstats',
+    f"echo '{COLLECT_SECTION_MARK}netdev'", 'r /proc/net/dev',
+    f"echo '{COLLECT_SECTION_MARK}df'", 'df -P /',
+    f"echo '{COLLECT_SECTION_MARK}end'",
+])
+
+# 只统计整块物理磁盘，跳过分区、loop、ram、device-mapper 等设备，避免重复计数
+DISK_DEVICE_RE = re.compile(r'^(sd[a-z]+|vd[a-z]+|xvd[a-z]+|hd[a-z]+|nvme\d+n\d+|mmcblk\d+)$')
+DISK_SECTOR_BYTES = 512
+
+# 每台主机上一次采样的计数器，用于计算差值
+collector_state = {}
+collector_state_lock = threading.Lock()
+
+def parse_proc_counters(output):
+    """单次遍历解析采集脚本输出，提取原始计数器"""
+    counters = {}
+    meminfo = {}
+    disk_read = disk_write = 0
+    net_rx = net_tx = 0
+    section = None
+
+    for line in output.splitlines():
+        if line.startswith(COLLECT_SECTION_MARK):
+            section = line[len(COLLECT_SECTION_MARK):].strip()
+            continue
+        fields = line.split()
+        if not fields:
+            continue
+
+        try:
+            if section == 'uptime':
+                counters['uptime'] = float(fields[0])
+            elif section == 'stat' and fields[0] == 'cpu':
+                # cpu  user nice system idle iowait irq softirq steal guest guest_nice
+                # guest/guest_nice 已计入 user/nice，只累加前 8 项
+                values = [int(x) for x in fields[1:9]]
+                idle = values[3] + (values[4] if len(values) > 4 else 0)
+                counters['cpu'] = (sum(values), idle)
+            elif section == 'meminfo':
+                meminfo[fields[0].rstrip(':')] = int(fields[1])
+            elif section == 'loadavg':
+                counters['load_avg'] = [round(float(x), 2) for x in fields[:3]]
+            elif section == 'diskstats' and len(fields) >= 10 and DISK_DEVICE_RE.match(fields[2]):
+                # major minor name reads merged sectors_read ms writes merged sectors_written ...
+                disk_read += int(fields[5])
+                disk_write += int(fields[9])
+            elif section == 'netdev' and ':' in line:
+                name, data = line.split(':', 1)
+                if name.strip() != 'lo':
+                    data = data.split()
+                    net_rx += int(data[0])
+                    net_tx += int(data[8])
+            elif section == 'df' and len(fields) >= 5 and fields[4].endswith('%'):
+                counters['disk_usage'] = float(fields[4][:-1])
+        except (ValueError, IndexError):
+            pass
+
+    if 'MemTotal' in meminfo:
+        total = meminfo['MemTotal']
+        available = meminfo.get('MemAvailable',
+                                meminfo.get('MemFree', 0) + meminfo.get('Buffers', 0) + meminfo.get('Cached', 0))
+        counters['memory'] = (total, total - available)
+    counters['disk_io'] = (disk_read, disk_write)
+    counters['net_io'] = (net_rx, net_tx)
+    return counters
+
+def calc_rate(prev, curr, elapsed):
+    """计数器差值速率；计数器回绕或重启时返回 None"""
+    if prev is None or elapsed <= 0 or curr < prev:
+        return None
+    return round((curr - prev) / elapsed, 2)
+
+def compute_host_rates(host_id, counters):
+    """根据本次与上次采样的计数器差值计算各项指标"""
+    if 'cpu' not in counters or 'memory' not in counters:
+        raise ValueError('采集输出缺少 /proc/stat 或 /proc/meminfo')
+
+    with collector_state_lock:
+        prev = collector_state.get(host_id)
+        collector_state[host_id] = counters
+
+    # uptime 变小说明主机重启过，旧计数器作废
+    elapsed = 0
+    if prev and 'uptime' in counters and 'uptime' in prev:
+        elapsed = counters['uptime'] - prev['uptime']
+    if elapsed <= 0:
+        prev = None
+
+    # 首次采样（新连接、服务重启、熔断恢复后）只有开机以来的平均值，不能当作当前使用率
+    cpu_usage = None
+    if prev:
+        total_delta = counters['cpu'][0] - prev['cpu'][0]
+        idle_delta = counters['cpu'][1] - prev['cpu'][1]
+        if total_delta > 0:
+            cpu_usage = round(max(0.0, min(100.0, (total_delta - idle_delta) / total_delta * 100)), 2)
+
+    memory_total_kb, memory_used_kb = counters['memory']
+    memory_total = round(memory_total_kb / 1024)
+    memory_used = round(memory_used_kb / 1024)
+
+    metrics = {
+        'cpu_usage': cpu_usage,
+        'memory_usage': round(memory_used_kb / memory_total_kb * 100, 2) if memory_total_kb > 0 else 0,
+        'memory_total': memory_total,
+        'memory_used': memory_used,
+        'disk_usage': counters.get('disk_usage'),
+        'load_avg': counters.get('load_avg', []),
+        'disk_read_bps': None,
+        'disk_write_bps': None,
+        'net_rx_bps': None,
+        'net_tx_bps': None
+    }
+
+    if prev:
+        read_rate = calc_rate(prev['disk_io'][0], counters['disk_io'][0], elapsed)
+        write_rate = calc_rate(prev['disk_io'][1], counters['disk_io'][1], elapsed)
+        metrics['disk_read_bps'] = read_rate * DISK_SECTOR_BYTES if read_rate is not None else None
+        metrics['disk_write_bps'] = write_rate * DISK_SECTOR_BYTES if write_rate is not None else None
+        metrics['net_rx_bps'] = calc_rate(prev['net_io'][0], counters['net_io'][0], elapsed)
+        metrics['net_tx_bps'] = calc_rate(prev['net_io'][1], counters['net_io'][1], elapsed)
+
+    return metrics
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# 导入 app 之前指定临时数据库，并且不启动采集和后台维护
+os.environ['DATABASE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='monitor-test-'), 'monitor.db')
+os.environ['START_SCHEDULER'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
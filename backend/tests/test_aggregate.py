@@ -0,0 +1,24 @@
+import pytest
+
+import app
+
+@pytest.mark.parametrize('vectorized', [True, False])
+def test_empty_group_counts_and_sums_are_zero(vectorized):
+    # 主机 1 在分组 0，主机 2 在分组 1 但没有任何样本
+    host_group = {1: 0, 2: 1}
+    blocks = [[(1, 2.0), (1, 4.0)]]
+
+    def aggregate(stat, q=None, data=blocks):
+        if vectorized:
+            columns = [app.np.array(block, dtype=app.np.float64) for block in data]
+            return app.aggregate_vectorized(iter(columns), app.host_group_lookup(host_group), 2, stat, q)
+        return app.aggregate_rows(iter(data), host_group, 2, stat, q)
+
+    assert aggregate('count') == ([2, 0], [2, 0])
+    assert aggregate('sum') == ([6.0, 0], [2, 0])
+    for stat, q in (('mean', None), ('min', None), ('max', None), ('quantile', 0.5)):
+        assert aggregate(stat, q)[0][1] is None
+    # 时间范围内完全没有数据
+    assert aggregate('count', data=[]) == ([0, 0], [0, 0])
+    assert aggregate('sum', data=[]) == ([0, 0], [0, 0])
+    assert aggregate('max', data=[]) == ([None, None], [0, 0])
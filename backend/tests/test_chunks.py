@@ -0,0 +1,110 @@
+import math
+import random
+
+import app
+
+DAY = 86400
+
+def make_samples(host_id, part_start, count, step=5):
+    samples = []
+    for i in range(count):
+        samples.append((host_id, {
+            'cpu_usage': round(random.uniform(0, 100), 2),
+            'memory_usage': 42.5,
+            'memory_total': 8 * 1024 ** 3,
+            'memory_used': 3 * 1024 ** 3 + i,
+            'disk_usage': None if i % 7 == 0 else 61.0,
+            'load_avg': [0.5, 0.25, 0.125],
+            'timestamp': part_start + 60 + i * step + random.random() * 0.5,
+        }, 'simulated'))
+    return samples
+
+def history(host_id, part_start):
+    points, _ = app.query_metrics_history(host_id, part_start, part_start + DAY - 1, limit=100000)
+    return points
+
+def partition_exists(parts, part_start):
+    with app.get_db() as conn:
+        return app.table_exists(conn, parts.table_for(part_start))
+
+def test_chunk_round_trip():
+    random.seed(1)
+    timestamps = [1700000000000]
+    for _ in range(999):
+        # 规律间隔、抖动、大间隔都要覆盖到时间戳二阶差分的各个分档
+        timestamps.append(timestamps[-1] + random.choice([5000, 5000, 5000, 4987, 5013, 60000, 3600000, 1]))
+    values = [random.choice([None, 0.0, -1.5, 100.0, 1e-300, 1e300, random.uniform(-1e6, 1e6), 42.0])
+              for _ in timestamps]
+
+    data = app.encode_chunk(timestamps, values)
+    decoded = list(app.decode_chunk(data, len(timestamps)))
+
+    assert [ts for ts, _ in decoded] == timestamps
+    assert [value for _, value in decoded] == values
+    assert len(data) < len(timestamps) * 16
+
+def test_chunk_round_trip_single_point():
+    decoded = list(app.decode_chunk(app.encode_chunk([123], [math.pi]), 1))
+    assert decoded == [(123, math.pi)]
+
+def test_compact_partition_round_trip():
+    random.seed(2)
+    part_start = app.raw_partitions.start_of(1700000000) - 10 * DAY
+    app.save_metrics_many(make_samples(1, part_start, 500) + make_samples(2, part_start, 300))
+    before = {host_id: history(host_id, part_start) for host_id in (1, 2)}
+    assert [len(before[1]), len(before[2])] == [500, 300]
+
+    app.compact_partition(part_start)
+
+    assert not partition_exists(app.raw_partitions, part_start)
+    assert partition_exists(app.chunk_partitions, part_start)
+    for host_id in (1, 2):
+        assert history(host_id, part_start) == before[host_id]
+
+def test_compact_partition_keeps_samples_written_during_compaction(monkeypatch):
+    random.seed(3)
+    part_start = app.raw_partitions.start_of(1700000000) - 20 * DAY
+    app.save_metrics_many(make_samples(1, part_start, 200) + make_samples(2, part_start, 200))
+    late = make_samples(1, part_start, 1)
+    late[0][1]['timestamp'] = part_start + DAY - 10
+
+    # 所有主机都压缩完、检查原始分区是否为空之前，写入一条已压缩主机的迟到样本
+    drop_partition_if_empty = app.drop_partition_if_empty
+
+    def late_write_then_drop(parts, table):
+        app.save_metrics_many(late)
+        return drop_partition_if_empty(parts, table)
+
+    monkeypatch.setattr(app, 'drop_partition_if_empty', late_write_then_drop)
+    app.compact_partition(part_start)
+    monkeypatch.setattr(app, 'drop_partition_if_empty', drop_partition_if_empty)
+
+    assert partition_exists(app.raw_partitions, part_start)
+    assert len(history(1, part_start)) == 201
+
+    app.compact_partition(part_start)
+
+    assert not partition_exists(app.raw_partitions, part_start)
+    points = history(1, part_start)
+    assert len(points) == 201
+    assert points[-1]['timestamp'] == round(late[0][1]['timestamp'] * 1000) / 1000
+    assert len(history(2, part_start)) == 200
+
+def test_paging_compacted_partition_matches_raw():
+    random.seed(4)
+    part_start = app.raw_partitions.start_of(1700000000) - 30 * DAY
+    # 超过 CHUNK_MAX_POINTS，游标会跨越多个数据块
+    app.save_metrics_many(make_samples(5, part_start, app.CHUNK_MAX_POINTS * 2 + 100, step=2))
+
+    def paged(limit):
+        points, after = [], None
+        while True:
+            page, cursor = app.query_metrics_history(5, part_start, part_start + DAY - 1, limit=limit, after=after)
+            points.extend(page)
+            if not cursor:
+                return points
+            after = app.decode_cursor(cursor)
+
+    before = paged(700)
+    app.compact_partition(part_start)
+    assert paged(700) == before
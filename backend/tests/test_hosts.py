@@ -0,0 +1,41 @@
+import pytest
+
+import app
+
+@pytest.fixture(scope='module')
+def page_hosts():
+    # 名称有重复，游标要靠 id 区分同名主机
+    rows = [(f'10.8.0.{i}', 'u', 'p', 22, f'pagetest-{i % 4}', 'real', None) for i in range(23)]
+    return app.add_hosts_many(rows)
+
+@pytest.mark.parametrize('sort', ['name', 'id', 'created_at', 'ip'])
+@pytest.mark.parametrize('descending', [True, False])
+def test_keyset_pages_match_offset_listing(page_hosts, sort, descending):
+    expected, total, _ = app.query_hosts_page(name_prefix='pagetest-', sort=sort, descending=descending, limit=100)
+    assert total == len(page_hosts) == len(expected)
+
+    walked, after = [], None
+    while True:
+        hosts, total, cursor = app.query_hosts_page(name_prefix='pagetest-', sort=sort, descending=descending,
+                                                    limit=5, after=after)
+        walked.extend(hosts)
+        if cursor is None:
+            break
+        field, *after = app.decode_cursor(cursor)
+        assert field == sort
+    assert [host['id'] for host in walked] == [host['id'] for host in expected]
+
+def test_cursor_from_another_sort_or_paging_mode_is_rejected(page_hosts):
+    client = app.app.test_client()
+    first = client.get('/api/hosts?sort=name&limit=2&name=pagetest-').get_json()
+    cursor = first['next_cursor']
+    assert client.get(f'/api/hosts?sort=name&limit=2&name=pagetest-&cursor={cursor}').status_code == 200
+
+    realtime_cursor = app.encode_cursor('name', 2)
+    for query in (f'sort=ip&limit=2&cursor={cursor}',                  # 其他排序字段的游标
+                  f'sort=name&status=online&limit=2&cursor={cursor}',  # 主机表游标用于内存分页
+                  f'sort=name&limit=2&cursor={realtime_cursor}',       # 内存分页游标用于主机表
+                  f'sort=cpu_usage&limit=2&cursor={app.encode_cursor("cpu_usage", -1)}',
+                  f'sort=name&limit=2&cursor={app.encode_cursor("name", "x", True)}',
+                  'sort=name&limit=2&cursor=zz'):
+        assert client.get(f'/api/hosts?{query}').status_code == 400, query
@@ -0,0 +1,100 @@
+import time
+
+import pytest
+
+import app
+
+DAY = 86400
+
+def test_partition_created_in_rolled_back_transaction_is_recreated():
+    first_day = app.raw_partitions.start_of(time.time()) - 40 * DAY
+    second_day = first_day + DAY
+    good = (1, {'cpu_usage': 1.0, 'timestamp': first_day + 60}, 'real')
+    # 第二天的分区在事务中途建表，随后绑定参数失败，整个事务回滚
+    bad = (1, {'memory_total': {'not': 'a number'}, 'timestamp': second_day + 60}, 'real')
+    with pytest.raises(Exception):
+        app.save_metrics_many([good, bad])
+
+    app.save_metrics_many([(1, {'cpu_usage': 2.0, 'timestamp': second_day + 60}, 'real')])
+
+    points, _ = app.query_metrics_history(1, second_day, second_day + DAY - 1)
+    assert [point['cpu_usage'] for point in points] == [2.0]
+
+def test_migrated_partition_gets_host_timestamp_index(monkeypatch):
+    monkeypatch.setattr(app, 'MIGRATION_PAUSE', 0)
+    part_start = app.raw_partitions.start_of(time.time()) - 50 * DAY
+    table = app.raw_partitions.table_for(part_start)
+    with app.get_db() as conn:
+        # 旧格式分区：文本时间戳 + load_avg JSON，索引名与新格式分区相同
+        conn.execute(f'''
+            CREATE TABLE {table} (
+                id INTEGER PRIMARY KEY, host_id INTEGER NOT NULL, cpu_usage REAL, memory_usage REAL,
+                memory_total REAL, memory_used REAL, disk_usage REAL, load_avg TEXT,
+                data_source TEXT DEFAULT 'real', timestamp TIMESTAMP
+            )
+        ''')
+        conn.execute(f'CREATE INDEX idx_{table}_host_ts ON {table} (host_id, timestamp)')
+        conn.executemany(f"INSERT INTO {table} (host_id, cpu_usage, load_avg, timestamp) VALUES (?, ?, '[1, 2, 3]', ?)",
+                         [(1, float(i), app.to_db_timestamp(part_start + 60 * i)) for i in range(10)])
+
+    app.detach_legacy_partitions()
+    app.migrate_legacy_partitions()
+
+    with app.get_db() as conn:
+        plan = ' '.join(row[-1] for row in conn.execute(
+            f'EXPLAIN QUERY PLAN SELECT * FROM {table} WHERE host_id = ? AND timestamp >= ?', (1, 0)))
+    assert f'idx_{table}_host_ts' in plan
+    points, _ = app.query_metrics_history(1, part_start, part_start + DAY - 1)
+    assert [point['cpu_usage'] for point in points] == [float(i) for i in range(10)]
+    assert points[0]['load_avg'] == [1, 2, 3]
+
+class StopMigration(Exception):
+    pass
+
+def test_unpartitioned_legacy_table_is_visible_during_migration(monkeypatch):
+    monkeypatch.setattr(app, 'MIGRATION_BATCH_SIZE', 40)
+    host_id = app.add_host('10.77.0.1', 'u', 'p', name='legacy')
+    start = app.raw_partitions.start_of(time.time()) - 60 * DAY
+    stamps = [start + 3600 * i for i in range(100)]  # 跨越 5 天
+    with app.get_db() as conn:
+        conn.execute(f'''
+            CREATE TABLE {app.LEGACY_METRICS_TABLE} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, host_id INTEGER NOT NULL, cpu_usage REAL, memory_usage REAL,
+                memory_total REAL, memory_used REAL, disk_usage REAL, load_avg TEXT,
+                data_source TEXT DEFAULT 'real', timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.executemany(f"INSERT INTO {app.LEGACY_METRICS_TABLE} (host_id, cpu_usage, load_avg, timestamp) VALUES (?, ?, '[1]', ?)",
+                         [(host_id, float(i), app.to_db_timestamp(ts)) for i, ts in enumerate(stamps)])
+
+    def check():
+        points, after = [], None
+        while True:
+            page, cursor = app.query_metrics_history(host_id, start, stamps[-1], ['cpu_usage'], limit=30, after=after)
+            points.extend(page)
+            if not cursor:
+                break
+            after = app.decode_cursor(cursor)
+        assert [point['timestamp'] for point in points] == stamps
+        assert [point['cpu_usage'] for point in points] == [float(i) for i in range(100)]
+        groups, _ = app.aggregate_metric('cpu_usage', 'count', 'all', start, stamps[-1], [host_id], vectorized=False)
+        assert groups[0]['samples'] == 100
+
+    check()
+
+    # 只迁移一批就停下：一部分在按天分区，其余仍在旧表
+    def stop(seconds):
+        raise StopMigration()
+    monkeypatch.setattr(app.time, 'sleep', stop)
+    with pytest.raises(StopMigration):
+        app.migrate_legacy_partitions()
+    monkeypatch.undo()
+    with app.get_db() as conn:
+        assert conn.execute(f'SELECT count(*) FROM {app.LEGACY_METRICS_TABLE}').fetchone()[0] == 60
+    check()
+
+    monkeypatch.setattr(app, 'MIGRATION_PAUSE', 0)
+    app.migrate_legacy_partitions()
+    with app.get_db() as conn:
+        assert not app.table_exists(conn, app.LEGACY_METRICS_TABLE)
+    check()
@@ -0,0 +1,75 @@
+import json
+import random
+
+import pytest
+
+import app
+
+def entry(cpu, status='online'):
+    return {'status': status, 'cpu_usage': cpu, 'memory_usage': 50.0, 'load_avg': [cpu, 1.0, None]}
+
+def delta(store, since):
+    snapshot, body = store.delta(since)
+    return snapshot.version, json.loads(body)
+
+def test_delta_returns_changed_and_removed_hosts():
+    store = app.RealtimeStore(publish_interval=0, history=3)
+    base = store.snapshot().version
+    store.update(1, entry(10.0))
+    store.update(2, entry(20.0))
+    v1 = store.snapshot().version
+    store.remove(2)
+    store.update(3, entry(30.0))
+    v2 = store.snapshot().version
+
+    version, payload = delta(store, base)
+    assert version == v2
+    # 期间新增又删除的主机也列入 removed，客户端删除不存在的主机没有影响
+    assert (payload['full'], sorted(payload['hosts']), payload['removed']) == (False, ['1', '3'], [2])
+    _, payload = delta(store, v1)
+    assert (payload['full'], sorted(payload['hosts']), payload['removed']) == (False, ['3'], [2])
+    _, payload = delta(store, v2)
+    assert (payload['full'], payload['hosts'], payload['removed']) == (False, {}, [])
+    # 未知的版本（早于启动或晚于当前版本）返回全量
+    for since in (base - 1, v2 + 1):
+        _, payload = delta(store, since)
+        assert payload['full'] and sorted(payload['hosts']) == ['1', '3']
+
+def test_delta_falls_back_to_full_when_changelog_is_exhausted():
+    store = app.RealtimeStore(publish_interval=0, history=2)
+    base = store.snapshot().version
+    for cpu in (1.0, 2.0, 3.0):
+        store.update(1, entry(cpu))
+        store.snapshot()
+    snapshot = store.snapshot()
+
+    assert store.changes_since(base, snapshot) is None
+    assert store.changes_since(base + 1, snapshot) == {1}
+    _, payload = delta(store, base)
+    assert payload['full'] and payload['hosts']['1']['cpu_usage'] == 3.0
+
+def test_dashboard_incremental_update_matches_rebuild():
+    random.seed(5)
+    hosts = app.add_hosts_many([(f'10.9.0.{i}', 'u', 'p', 22, f'dash-{i}', 'real', None) for i in range(40)])
+    host_ids = [host['id'] for host in hosts]
+    store = app.RealtimeStore(publish_interval=0)
+    state = app.DashboardState(store)
+    state.refresh()
+
+    for _ in range(30):
+        for host_id in random.sample(host_ids, 8):
+            # 取值重复较多，覆盖 (值, host_id) 相同值的二分定位；还有离线、无数值和删除
+            action = random.random()
+            if action < 0.1:
+                store.remove(host_id)
+            elif action < 0.2:
+                store.update(host_id, entry(None))
+            else:
+                store.update(host_id, entry(random.choice([0.0, 12.5, 12.5, 50.0, 99.5]),
+                                            'offline' if action < 0.3 else 'online'))
+        incremental = dict(state.refresh())
+
+        rebuilt = app.DashboardState(store)
+        assert rebuilt.refresh() == incremental
+        assert state._ranked == rebuilt._ranked
+        assert state._totals == pytest.approx(rebuilt._totals)
@@ -0,0 +1,38 @@
+import time
+
+import app
+
+class FakeTransport:
+    def is_active(self):
+        return True
+
+    def is_authenticated(self):
+        return True
+
+class FakeClient:
+    def __init__(self):
+        self.closed = False
+
+    def get_transport(self):
+        return FakeTransport()
+
+    def close(self):
+        self.closed = True
+
+def test_idle_timeout_covers_long_collect_intervals(monkeypatch):
+    pool = app.SSHConnectionPool(idle_timeout=300)
+    monkeypatch.setattr(pool, '_connect', lambda host: FakeClient())
+    hourly = {'ip': '10.7.0.1', 'username': 'u', 'password': 'p', 'collect_interval': 3600}
+    default = {'ip': '10.7.0.2', 'username': 'u', 'password': 'p', 'collect_interval': None}
+    hourly_client, _ = pool.acquire(hourly)
+    default_client, _ = pool.acquire(default)
+
+    # 两台主机都已空闲 400 秒：默认间隔的主机超时回收，每小时采集一次的主机保留到下一次采集
+    for entry in pool._connections.values():
+        entry['last_used'] = time.time() - 400
+    assert pool.evict_idle() == 1
+    assert default_client.closed and not hourly_client.closed
+    assert pool.acquire(hourly) == (hourly_client, True)
+
+    pool._connections[pool._key(hourly)]['last_used'] = time.time() - 2 * 3600 - 1
+    assert pool.evict_idle() == 1 and hourly_client.closed
@@ -5,15 +5,18 @@ class Dashboard {
     constructor() {
         this.hosts = [];
         this.metrics = {};
+        this.stats = null; // 服务端计算的全体统计
+        this.metricsVersion = 0; // 已合并的实时数据版本，0 表示还没有全量数据
         this.autoRefreshInterval = null;
+        this.eventSource = null;
+        this.renderTimer = null;
         this.init();
     }
 
     async init() {
-        await this.loadHosts();
+        await this.updateDashboard();
         this.setupAutoRefresh();
         this.setupEventListeners();
-        this.updateDashboard();
     }
 
     setupEventListeners() {
@@ -35,19 +38,42 @@ class Dashboard {
     }
 
     startAutoRefresh() {
-        this.stopAutoRefresh(); // 清除现有间隔
-        this.autoRefreshInterval = setInterval(() => {
-            this.updateDashboard();
-        }, 5000); // 每5秒刷新一次
+        this.stopAutoRefresh(); // 清除现有连接
+        if (window.EventSource) {
+            // 服务端推送：数据有变化时才收到增量，断线后浏览器自动带 Last-Event-ID 重连
+            this.eventSource = new EventSource(`${API_BASE}/api/stream`);
+            this.eventSource.addEventListener('metrics', (e) => {
+                this.applyMetricsDelta(JSON.parse(e.data));
+                this.scheduleRender();
+            });
+            this.eventSource.addEventListener('stats', (e) => {
+                const stats = JSON.parse(e.data);
+                if (!this.stats || stats.version >= this.stats.version) {
+                    this.stats = stats;
+                    this.scheduleRender();
+                }
+            });
+            this.eventSource.addEventListener('hosts', () => {
+                this.updateDashboard();
+            });
+        } else {
+            this.autoRefreshInterval = setInterval(() => {
+                this.updateDashboard();
+            }, 5000); // 不支持 EventSource 时每5秒轮询一次
+        }
         
         // 更新按钮状态
         const refreshBtn = document.getElementById('refreshBtn');
         if (refreshBtn) {
-            refreshBtn.textContent = `自动刷新中 (${new Date().toLocaleTimeString()})`;
+            refreshBtn.textContent = `实时更新中 (${new Date().toLocaleTimeString()})`;
         }
     }
 
     stopAutoRefresh() {
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
         if (this.autoRefreshInterval) {
             clearInterval(this.autoRefreshInterval);
             this.autoRefreshInterval = null;
@@ -74,78 +100,70 @@ class Dashboard {
         }
     }
 
-    async loadHosts() {
-        try {
-            const response = await fetch(`${API_BASE}/api/hosts`);
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
+    async loadDashboard() {
+        // 一次请求取回主机列表（已带实时数据）和服务端统计
+        const response = await fetch(`${API_BASE}/api/dashboard`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        const metrics = {};
+        data.hosts.forEach(host => {
+            if (host.metrics) {
+                metrics[host.id] = host.metrics;
             }
-            this.hosts = await response.json();
-            return this.hosts;
-        } catch (error) {
-            console.error('加载主机列表失败:', error);
-            this.showMessage('加载主机列表失败: ' + error.message, 'error');
-            return [];
+        });
+        this.hosts = data.hosts;
+        this.metrics = metrics;
+        this.metricsVersion = data.version;
+        this.stats = data.stats;
+    }
+
+    applyMetricsDelta(delta) {
+        // 比已合并版本旧的增量直接忽略
+        if (!delta.full && delta.version <= this.metricsVersion) {
+            return;
         }
+        const metrics = delta.full ? {} : { ...this.metrics };
+        Object.assign(metrics, delta.hosts);
+        delta.removed.forEach(hostId => delete metrics[hostId]);
+        this.metrics = metrics;
+        this.metricsVersion = delta.version;
     }
 
-    async loadMetrics() {
-        try {
-            const response = await fetch(`${API_BASE}/api/metrics`);
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-            this.metrics = await response.json();
-            return this.metrics;
-        } catch (error) {
-            console.error('加载监控数据失败:', error);
-            this.showMessage('加载监控数据失败: ' + error.message, 'error');
-            return {};
+    scheduleRender() {
+        // 事件密集时合并渲染，最多每秒重绘一次
+        if (this.renderTimer) {
+            return;
         }
+        this.renderTimer = setTimeout(() => {
+            this.renderTimer = null;
+            this.updateStatsOverview();
+            this.renderServerCards();
+        }, 1000);
     }
 
     async updateDashboard() {
         try {
-            // 并行加载主机和监控数据
-            const [hosts, metrics] = await Promise.all([
-                this.loadHosts(),
-                this.loadMetrics()
-            ]);
-
-            this.hosts = hosts;
-            this.metrics = metrics;
-
+            await this.loadDashboard();
             this.updateStatsOverview();
             this.renderServerCards();
-            
         } catch (error) {
             console.error('更新监控大屏失败:', error);
+            this.showMessage('加载监控数据失败: ' + error.message, 'error');
         }
     }
 
     updateStatsOverview() {
-        const totalHosts = this.hosts.length;
-        let onlineHosts = 0;
-        let offlineHosts = 0;
-        let simulatedHosts = 0;
-
-        // 统计主机状态
-        this.hosts.forEach(host => {
-            const hostMetrics = this.metrics[host.id];
-            if (host.host_type === 'simulated') {
-                simulatedHosts++;
-            } else if (hostMetrics && hostMetrics.status === 'online') {
-                onlineHosts++;
-            } else {
-                offlineHosts++;
-            }
-        });
+        // 统计由服务端按版本增量维护，这里只负责显示
+        const stats = this.stats || { total: 0, online: 0, offline: 0, simulated: 0 };
+        const totalHosts = stats.total;
 
         // 更新统计卡片
         document.getElementById('totalHosts').textContent = totalHosts;
-        document.getElementById('onlineHosts').textContent = onlineHosts;
-        document.getElementById('offlineHosts').textContent = offlineHosts;
-        document.getElementById('simulatedHosts').textContent = simulatedHosts;
+        document.getElementById('onlineHosts').textContent = stats.online;
+        document.getElementById('offlineHosts').textContent = stats.offline;
+        document.getElementById('simulatedHosts').textContent = stats.simulated;
 
         // 显示/隐藏无主机消息
         const noHostsMessage = document.getElementById('noHostsMessage');
@@ -228,6 +246,8 @@ class Dashboard {
         if (!metrics) return '';
 
         const cpuUsage = metrics.cpu_usage || 0;
+        // 首次采样还没有上一次的计数器，CPU 使用率为空
+        const cpuText = metrics.cpu_usage == null ? '--' : `${cpuUsage.toFixed(1)}%`;
         const memoryUsage = metrics.memory_usage || 0;
         const diskUsage = metrics.disk_usage || 0;
         const loadAvg = metrics.load_avg || [0, 0, 0];
@@ -249,11 +269,11 @@ class Dashboard {
                 <div class="metric">
                     <div class="metric-label">
                         <span>CPU 使用率</span>
-                        <span class="metric-value">${cpuUsage.toFixed(1)}%</span>
+                        <span class="metric-value">${cpuText}</span>
                     </div>
                     <div class="progress">
                         <div class="progress-bar ${cpuBarClass}" style="width: ${Math.min(cpuUsage, 100)}%">
-                            <span class="progress-value">${cpuUsage.toFixed(1)}%</span>
+                            <span class="progress-value">${cpuText}</span>
                         </div>
                     </div>
                 </div>
@@ -62,6 +62,7 @@ class HostManager {
         // 按类型分组
         const realHosts = hosts.filter(h => h.host_type === 'real');
         const simulatedHosts = hosts.filter(h => h.host_type === 'simulated');
+        const pushHosts = hosts.filter(h => h.host_type === 'push');
 
         let html = '';
 
@@ -71,6 +72,12 @@ class HostManager {
             html += realHosts.map(host => this.renderHostCard(host)).join('');
         }
 
+        // 显示 Agent 推送主机
+        if (pushHosts.length > 0) {
+            html += '<h3 style="margin-top: 30px;">Agent 推送主机</h3>';
+            html += pushHosts.map(host => this.renderHostCard(host)).join('');
+        }
+
         // 显示模拟主机
         if (simulatedHosts.length > 0) {
             html += '<h3 style="margin-top: 30px;">模拟主机</h3>';
@@ -84,6 +91,8 @@ class HostManager {
         const hostType = host.host_type || 'real';
         const typeBadge = hostType === 'simulated' ? 
             '<span class="host-type-badge host-type-simulated">模拟主机</span>' : 
+            hostType === 'push' ?
+            '<span class="host-type-badge host-type-real">Agent 推送</span>' :
             '<span class="host-type-badge host-type-real">真实服务器</span>';
         
         return `